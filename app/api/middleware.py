@@ -0,0 +1,38 @@
+"""ASGI middleware for request guards."""
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.api.responses import OrjsonResponse
+
+
+class BodySizeLimitMiddleware:
+    """Reject requests whose declared body exceeds a byte limit.
+
+    Runs before routing and JSON decoding, so oversized bodies are refused
+    with 413 without ever being read into memory.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: int):
+        """Initialize the middleware.
+
+        Args:
+            app: The wrapped ASGI application.
+            max_body_bytes: Maximum allowed Content-Length (0 disables the check).
+        """
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.max_body_bytes > 0:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_body_bytes:
+                        response = OrjsonResponse(
+                            {"detail": "Request body too large"},
+                            status_code=413,
+                        )
+                        await response(scope, receive, send)
+                        return
+                    break
+
+        await self.app(scope, receive, send)
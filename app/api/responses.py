@@ -0,0 +1,20 @@
+"""JSON responses rendered with orjson."""
+
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+
+
+class OrjsonResponse(Response):
+    """JSON response serialized with ``orjson.dumps``.
+
+    Replaces FastAPI's ``ORJSONResponse``, which newer releases deprecate.
+    Content is dumped as-is, so orjson-native types such as dataclasses need
+    no conversion first.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
@@ -1,16 +1,20 @@
 """API route definitions."""
 
 import asyncio
-import json
+import hashlib
+import io
 import logging
 import secrets
 import time
-from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Callable
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from sse_starlette.sse import EventSourceResponse
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
+from app.api.responses import OrjsonResponse
 from app.api.schemas import (
     BenchmarkRequest,
     BenchmarkResponse,
@@ -21,55 +25,136 @@ from app.api.schemas import (
     KeyGenerateRequest,
     KeyGenerateResponse,
 )
-from app.config import get_settings
-from app.core.auth import verify_api_key
-from app.core.keys import KeyStore
+from app.config import FrozenSettings, get_settings
+from app.core.auth import tenant_id, verify_api_key
 from app.core.queue import InferenceRequest
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Pre-framed SSE events; only the token list needs encoding per frame.
+_TOKENS_FRAME = b'event: tokens\ndata: {"tokens":%s,"done":false}\n\n'
+_DONE_FRAME = (
+    b"event: done\n"
+    b'data: {"done":true,"prompt_tokens":%d,"completion_tokens":%d,"total_tokens":%d}'
+    b"\n\n"
+)
+_ERROR_FRAME = b"event: error\ndata: %s\n\n"
+_PING_FRAME = b": ping\n\n"
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# Probes hit /health every few seconds; serve a short-lived snapshot instead of
+# re-reading shared service state on every call.
+_HEALTH_SNAPSHOT_TTL_S = 0.5
+_health_snapshot: tuple[float, dict | None] = (0.0, None)
+
 
-def _effective_max_tokens(requested: int | None, queue_size: int, settings) -> int:
-    """Compute max_tokens with Pi-safe caps and load-aware downscaling."""
-    desired = requested if requested is not None else settings.max_tokens
-    capped = min(desired, settings.max_request_tokens_cap)
+_MAX_TOKENS_POLICY_SRC = """
+def effective_max_tokens(requested, queue_size):
+    desired = {default} if requested is None else requested
+    capped = desired if desired < {cap} else {cap}
 
     # If any request is queued, prioritize responsiveness over long completions.
-    if queue_size > 0:
-        capped = min(capped, settings.busy_max_tokens)
+    if queue_size > 0 and capped > {busy_cap}:
+        capped = {busy_cap}
+
+    return capped if capped > 1 else 1
+"""
+
+
+def build_max_tokens_policy(settings: FrozenSettings) -> Callable[[int | None, int], int]:
+    """Compile a max_tokens policy with the settings limits baked in as constants.
+
+    Settings are frozen after startup, so the caps are emitted as literals and
+    the per-request call does no attribute lookups.
+    """
+    source = _MAX_TOKENS_POLICY_SRC.format(
+        default=int(settings.max_tokens),
+        cap=int(settings.max_request_tokens_cap),
+        busy_cap=int(settings.busy_max_tokens),
+    )
+    namespace: dict = {}
+    exec(compile(source, "<max_tokens_policy>", "exec"), namespace)
+    return namespace["effective_max_tokens"]
+
+
+# get_settings() returns one snapshot for the process, so the policy is
+# compiled once at import and the route calls it as a plain module global.
+_effective_max_tokens = build_max_tokens_policy(get_settings())
+
+
+def _response_cache_key(model: str, body: GenerateRequest, max_tokens: int) -> bytes:
+    """Hash every input that determines a deterministic completion."""
+    normalized = orjson.dumps(
+        [
+            model,
+            body.prompt,
+            body.system,
+            max_tokens,
+            body.temperature,
+            body.top_p,
+            body.top_k,
+            body.stop or [],
+        ]
+    )
+    return hashlib.blake2b(normalized, digest_size=16).digest()
 
-    return max(1, capped)
+
+async def parse_generate_request(request: Request) -> GenerateRequest:
+    """Validate the /generate body directly from the raw JSON bytes.
+
+    pydantic-core parses and validates in one pass, skipping the intermediate
+    dict FastAPI would otherwise build before validating.
+    """
+    try:
+        return GenerateRequest.model_validate_json(await request.body())
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in exc.errors(include_url=False)
+            ]
+        ) from exc
 
 
 @router.get(
     "/health",
-    response_model=HealthResponse,
+    response_model=None,
+    responses={200: {"model": HealthResponse, "description": "Service health"}},
     tags=["Health"],
     summary="Health check endpoint",
 )
-async def health_check(request: Request) -> HealthResponse:
+async def health_check(request: Request) -> OrjsonResponse:
     """Check the health status of the service."""
-    settings = get_settings()
+    global _health_snapshot
+
+    now = time.monotonic()
+    taken_at, cached = _health_snapshot
+    if cached is not None and now - taken_at < _HEALTH_SNAPSHOT_TTL_S:
+        return OrjsonResponse(cached)
+
+    settings = request.app.state.settings
     llm_manager = request.app.state.llm_manager
     request_queue = request.app.state.request_queue
     inference_service = request.app.state.inference_service
 
-    return HealthResponse(
-        status="healthy" if llm_manager and llm_manager.is_loaded else "degraded",
-        model_loaded=llm_manager.is_loaded if llm_manager else False,
-        model_path=settings.ollama_model,
-        queue_size=request_queue.size if request_queue else 0,
-        active_requests=inference_service.active_count if inference_service else 0,
-        max_concurrent=inference_service.max_concurrent if inference_service else 0,
-    )
+    # Shape documented by HealthResponse; built directly to skip validation.
+    payload = {
+        "status": "healthy" if llm_manager and llm_manager.is_loaded else "degraded",
+        "model_loaded": llm_manager.is_loaded if llm_manager else False,
+        "model_path": settings.ollama_model,
+        "queue_size": request_queue.size if request_queue else 0,
+        "active_requests": inference_service.active_count if inference_service else 0,
+        "max_concurrent": inference_service.max_concurrent if inference_service else 0,
+    }
+    _health_snapshot = (now, payload)
+    return OrjsonResponse(payload)
 
 
 @router.post(
     "/generate",
     responses={
-        200: {"description": "Successful generation"},
+        200: {"model": GenerateResponse, "description": "Successful generation"},
         401: {"model": ErrorResponse, "description": "Invalid API key"},
         429: {"model": ErrorResponse, "description": "Server busy"},
         503: {"model": ErrorResponse, "description": "Model not loaded"},
@@ -78,11 +163,19 @@ async def health_check(request: Request) -> HealthResponse:
     tags=["Generation"],
     summary="Generate text from prompt",
     description="Generate text using the LLM. Supports streaming via SSE (default) or synchronous JSON response.",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": GenerateRequest.model_json_schema()}
+            },
+        }
+    },
 )
 async def generate(
     request: Request,
-    body: GenerateRequest,
-    _: Annotated[str, Depends(verify_api_key)],
+    api_key: Annotated[str, Depends(verify_api_key)],
+    body: Annotated[GenerateRequest, Depends(parse_generate_request)],
 ):
     """Generate text from the given prompt."""
     llm_manager = request.app.state.llm_manager
@@ -101,12 +194,24 @@ async def generate(
             detail="Inference service not available.",
         )
 
-    settings = get_settings()
-    max_tokens = _effective_max_tokens(
-        requested=body.max_tokens,
-        queue_size=request_queue.size,
-        settings=settings,
-    )
+    settings = request.app.state.settings
+    max_tokens = _effective_max_tokens(body.max_tokens, request_queue.size)
+
+    # Deterministic requests can be answered from previous completions.
+    response_cache = getattr(request.app.state, "response_cache", None)
+    cache_key = None
+    if body.temperature == 0.0 and response_cache is not None:
+        cache_key = _response_cache_key(settings.ollama_model, body, max_tokens)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Serving /generate from response cache")
+            if body.stream:
+                return StreamingResponse(
+                    cached_stream_generator(cached),
+                    media_type="text/event-stream",
+                    headers=_SSE_HEADERS,
+                )
+            return OrjsonResponse(cached)
 
     # Create inference request
     inference_request = InferenceRequest(
@@ -118,6 +223,9 @@ async def generate(
         top_k=body.top_k,
         stop=body.stop or [],
         stream=body.stream,
+        tenant=tenant_id(api_key),
+        max_backlog=settings.sse_queue_max if body.stream else 0,
+        backlog_timeout_s=settings.sse_slow_client_timeout_s,
     )
 
     # Submit to inference service (handles threading/queuing automatically)
@@ -129,25 +237,28 @@ async def generate(
             detail=str(exc),
         ) from exc
 
-    logger.info(
-        f"Request {inference_request.id} submitted "
-        f"({'immediate' if is_immediate else 'queued'})"
+    logger.debug(
+        "Request %s submitted (%s)",
+        inference_request.id,
+        "immediate" if is_immediate else "queued",
     )
 
     if body.stream:
         # Streaming response via SSE
-        return EventSourceResponse(
-            stream_generator(inference_request),
+        return StreamingResponse(
+            stream_generator(inference_request, settings),
             media_type="text/event-stream",
+            headers=_SSE_HEADERS,
         )
     else:
         # Synchronous response
         try:
-            return await asyncio.wait_for(
+            payload = await asyncio.wait_for(
                 wait_for_completion(inference_request),
                 timeout=settings.sync_response_timeout_s,
             )
         except asyncio.TimeoutError as exc:
+            inference_request.cancel()  # Free the slot instead of finishing unseen
             raise HTTPException(
                 status_code=status.HTTP_504_GATEWAY_TIMEOUT,
                 detail=(
@@ -156,12 +267,16 @@ async def generate(
                 ),
             ) from exc
 
+        if cache_key is not None:
+            response_cache.set(cache_key, payload)
+        return OrjsonResponse(payload)
+
 
 @router.post(
     "/benchmark",
-    response_model=BenchmarkResponse,
+    response_model=None,
     responses={
-        200: {"description": "Benchmark completed"},
+        200: {"model": BenchmarkResponse, "description": "Benchmark completed"},
         401: {"model": ErrorResponse, "description": "Invalid API key"},
         503: {"model": ErrorResponse, "description": "Model not loaded"},
     },
@@ -176,7 +291,7 @@ async def benchmark(
     request: Request,
     body: BenchmarkRequest,
     _: Annotated[str, Depends(verify_api_key)],
-) -> BenchmarkResponse:
+) -> OrjsonResponse:
     """Benchmark model speed and return recommended settings."""
     llm_manager = request.app.state.llm_manager
     inference_service = request.app.state.inference_service
@@ -205,64 +320,102 @@ async def benchmark(
             context_sizes=body.context_sizes,
         )
     except Exception as e:
-        logger.error(f"Benchmark error: {e}")
+        logger.error("Benchmark error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Benchmark failed. Check server logs for details.",
         ) from e
 
-    return BenchmarkResponse(**result)
+    # The service builds the BenchmarkResponse shape itself; skip re-validation.
+    return OrjsonResponse(result)
+
 
+async def stream_generator(inference_request: InferenceRequest, settings):
+    """Generate pre-encoded SSE frames from inference request.
 
-async def stream_generator(inference_request: InferenceRequest):
-    """Generate SSE events from inference request."""
+    Takes up to ``sse_batch_tokens`` buffered tokens per frame, waiting at
+    most ``sse_batch_window_ms`` after the previous frame for the batch to
+    fill, so a token after a pause (e.g. the first one after prefill) goes out
+    without extra delay. Tokens already taken are flushed before an error.
+    """
+    loop = asyncio.get_running_loop()
+    max_tokens = max(1, settings.sse_batch_tokens)
+    window_s = settings.sse_batch_window_ms / 1000
+    last_flush = loop.time()
     try:
-        async for token in inference_request.token_stream():
-            yield {
-                "event": "token",
-                "data": json.dumps({"token": token, "done": False}),
-            }
+        while True:
+            batch = await inference_request.next_batch(
+                settings.sse_ping_interval_s, max_tokens
+            )
+            if batch is None:
+                break
+            if not batch:
+                yield _PING_FRAME
+                continue
+
+            try:
+                while len(batch) < max_tokens:
+                    remaining = last_flush + window_s - loop.time()
+                    if remaining <= 0:
+                        break
+                    more = await inference_request.next_batch(
+                        remaining, max_tokens - len(batch)
+                    )
+                    if not more:
+                        break
+                    batch.extend(more)
+            except Exception:
+                # Deliver tokens already taken before reporting the failure
+                yield _TOKENS_FRAME % orjson.dumps(batch)
+                raise
+
+            last_flush = loop.time()
+            yield _TOKENS_FRAME % orjson.dumps(batch)
 
         # Send completion event with stats
         stats = await inference_request.get_stats()
-        yield {
-            "event": "done",
-            "data": json.dumps(
-                {
-                    "done": True,
-                    "prompt_tokens": stats.get("prompt_tokens", 0),
-                    "completion_tokens": stats.get("completion_tokens", 0),
-                    "total_tokens": stats.get("total_tokens", 0),
-                }
-            ),
-        }
+        yield _DONE_FRAME % (
+            stats.get("prompt_tokens", 0),
+            stats.get("completion_tokens", 0),
+            stats.get("total_tokens", 0),
+        )
     except asyncio.CancelledError:
-        logger.info(f"Stream cancelled for request {inference_request.id}")
+        logger.info("Stream cancelled for request %s", inference_request.id)
         raise
     except Exception as e:
-        logger.error(f"Stream error for request {inference_request.id}: {e}")
-        yield {
-            "event": "error",
-            "data": json.dumps({"error": str(e)}),
-        }
+        logger.error("Stream error for request %s: %s", inference_request.id, e)
+        yield _ERROR_FRAME % orjson.dumps({"error": str(e)})
+    finally:
+        # Stop generating for a client that went away; no-op once complete.
+        inference_request.cancel()
+
+
+async def cached_stream_generator(payload: dict):
+    """Replay a cached completion as SSE frames."""
+    yield _TOKENS_FRAME % orjson.dumps([payload["text"]])
+    yield _DONE_FRAME % (
+        payload["prompt_tokens"],
+        payload["completion_tokens"],
+        payload["total_tokens"],
+    )
 
 
-async def wait_for_completion(inference_request: InferenceRequest) -> GenerateResponse:
-    """Wait for inference to complete and return full response."""
+async def wait_for_completion(inference_request: InferenceRequest) -> dict:
+    """Wait for inference to complete and return the `GenerateResponse` payload."""
     # Collect all tokens
-    tokens = []
+    buf = io.StringIO()
     async for token in inference_request.token_stream():
-        tokens.append(token)
+        buf.write(token)
 
-    text = "".join(tokens)
+    text = buf.getvalue()
     stats = await inference_request.get_stats()
 
-    return GenerateResponse(
-        text=text,
-        prompt_tokens=stats.get("prompt_tokens", 0),
-        completion_tokens=stats.get("completion_tokens", 0),
-        total_tokens=stats.get("total_tokens", 0),
-    )
+    return {
+        "text": text,
+        "prompt_tokens": stats.get("prompt_tokens", 0),
+        "completion_tokens": stats.get("completion_tokens", 0),
+        "total_tokens": stats.get("total_tokens", 0),
+    }
 
 
 @router.post(
@@ -273,29 +426,28 @@ async def wait_for_completion(inference_request: InferenceRequest) -> GenerateRe
     description="Create a new API key. No authentication required.",
 )
 async def generate_key(
+    request: Request,
     body: KeyGenerateRequest,
 ) -> KeyGenerateResponse:
     """Generate and store a new secure API key."""
     new_key = secrets.token_urlsafe(32)
-    settings = get_settings()
+    settings = request.app.state.settings
 
-    db_path = settings.api_keys_db
-    if not db_path:
+    if not settings.api_keys_db:
         raise HTTPException(
             status_code=status.HTTP_501_NOT_IMPLEMENTED,
             detail="SQLite key storage is not configured on this server.",
         )
 
-    # Resolve path
-    repo_root = Path(__file__).resolve().parents[2]
-    p = Path(db_path)
-    if not p.is_absolute():
-        p = (repo_root / p).resolve()
-
     try:
-        ks = KeyStore(p)
-        ks.add_key(new_key, owner=body.owner)
-        ks.close()
+        keystore = request.app.state.keystore
+        if keystore is None:
+            raise RuntimeError("Key store failed to open at startup")
+
+        # One shared connection: serialize writers on it, and keep the
+        # blocking SQLite insert off the event loop.
+        async with request.app.state.keystore_lock:
+            await asyncio.to_thread(keystore.add_key, new_key, owner=body.owner)
 
         return KeyGenerateResponse(
             api_key=new_key,
@@ -303,7 +455,7 @@ async def generate_key(
             created_at=int(time.time()),
         )
     except Exception as e:
-        logger.error(f"Failed to generate API key: {e}")
+        logger.error("Failed to generate API key: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal error while saving the new key.",
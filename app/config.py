@@ -1,14 +1,99 @@
 """Configuration settings using Pydantic Settings."""
 
 import hashlib
+from dataclasses import make_dataclass
 from functools import lru_cache
 from pathlib import Path
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
 
+# Relative paths in settings are resolved against the repository root
+_REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+@lru_cache(maxsize=8)
+def _load_api_key_hashes(
+    api_key_hashes: str | None, api_keys_path: str, env_path: str | None
+) -> frozenset[bytes]:
+    """Collect API key hashes from the env list and the keys files.
+
+    Hex digests are decoded to raw bytes so callers can compare them against
+    ``digest()`` output directly; malformed entries are skipped.
+    """
+    hashes: set[str] = set()
+    # First, check env var `API_KEY_HASHES` (comma-separated)
+    if api_key_hashes:
+        hashes.update(h for h in map(str.strip, api_key_hashes.split(",")) if h)
+
+    # Then, fallback to file-based hashes. Treat relative paths as
+    # repository-root-relative so the app finds the same file regardless
+    # of current working directory.
+    path = Path(api_keys_path)
+    if not path.is_absolute():
+        path = (_REPO_ROOT / path).resolve()
+    if path.exists():
+        try:
+            hashes.update(h for h in map(str.strip, path.read_text().splitlines()) if h)
+        except Exception:
+            pass
+
+    # Also allow an env var `API_KEYS_FILE` to override path
+    if env_path:
+        p = Path(env_path)
+        if not p.is_absolute():
+            p = (_REPO_ROOT / p).resolve()
+        if p.exists():
+            try:
+                hashes.update(h for h in map(str.strip, p.read_text().splitlines()) if h)
+            except Exception:
+                pass
+    # Note: if a SQLite DB is configured, it will be used instead of file-based
+    # lookup (see app/core/keys.py). This preserves backward-compatibility
+    # for code that wants a simple set of hashes.
+    return frozenset(filter(None, map(_hex_to_bytes, hashes)))
+
+
+def _hex_to_bytes(value: str) -> bytes | None:
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return None
+
+
+class _SettingsProperties:
+    """Derived settings shared by `Settings` and its frozen snapshot."""
+
+    __slots__ = ()
 
-class Settings(BaseSettings):
+    @property
+    def valid_api_key_hashes(self) -> frozenset[bytes]:
+        """Get all valid API key hashes (from env and keys files).
+
+        The files are read once per distinct configuration; call
+        `_load_api_key_hashes.cache_clear()` to pick up edits.
+        """
+        return _load_api_key_hashes(
+            self.api_key_hashes, self.api_keys_path, os.getenv("API_KEYS_FILE")
+        )
+
+    @property
+    def api_keys_db_resolved(self) -> Path | None:
+        """Get the SQLite key DB path resolved against the repo root, if set."""
+        if not self.api_keys_db:
+            return None
+        path = Path(self.api_keys_db)
+        if not path.is_absolute():
+            path = (_REPO_ROOT / path).resolve()
+        return path
+
+    @property
+    def model_path_resolved(self) -> Path:
+        """Get the resolved model path."""
+        return Path(self.model_path).resolve()
+
+
+class Settings(_SettingsProperties, BaseSettings):
     """Application settings loaded from environment variables."""
 
     model_config = SettingsConfigDict(
@@ -32,6 +117,7 @@ class Settings(BaseSettings):
     ollama_model: str = "qwen2.5:3b"
     ollama_keep_alive: str = "30m"
     ollama_warmup: bool = True
+    ollama_mlock: bool = False  # Lock model weights in RAM so they are never paged out
 
     # Legacy GGUF fields (kept for backward compatibility)
     model_path: str = "models/gemma-3-1b-it-Q4_K_M.gguf"
@@ -41,6 +127,7 @@ class Settings(BaseSettings):
     # LLM Settings (optimized for Raspberry Pi 5)
     n_ctx: int = 512  # Smaller context is faster on Pi-class CPUs
     n_threads: int = 4  # CPU threads for inference
+    n_batch: int = 512  # Prompt tokens evaluated per prefill step (Ollama num_batch)
     max_tokens: int = 96  # Lower default reduces latency significantly
 
     # Request handling/performance guards
@@ -48,63 +135,44 @@ class Settings(BaseSettings):
     busy_max_tokens: int = 64  # Auto-cap applied when queue is busy
     max_queue_wait_s: float = 20.0  # Drop stale queued requests quickly
     sync_response_timeout_s: float = 45.0  # Avoid long blocking non-stream calls
+    sse_queue_max: int = 32  # Tokens buffered per SSE client before the slow-client timer
+    sse_slow_client_timeout_s: float = 10.0  # Cancel generation if a client stalls
+    sse_batch_tokens: int = 4  # Max tokens per SSE frame; extra tokens wait for the next frame
+    sse_batch_window_ms: float = 30.0  # Max time a token waits for a batch to fill
+    sse_ping_interval_s: float = 15.0  # Keep-alive comment while no tokens arrive
+    response_cache_size: int = 256  # Cached temperature=0 completions (0 disables)
+    max_body_bytes: int = 65536  # Reject larger request bodies before parsing
 
     # Concurrency Settings
-    # Note: LLM inference is serialized (llama-cpp not thread-safe), but multiple
-    # requests can be tracked/queued. Higher values allow more pending requests.
+    # Note: each active request holds one worker thread; Ollama decides how many
+    # generations actually run in parallel (see OLLAMA_NUM_PARALLEL).
     max_concurrent_requests: int = 1  # One active generation is fastest/stablest on Pi
     max_queue_size: int = 8  # Keep queue short to prevent client-side timeouts
+    rate_limit_per_minute: float = 0.0  # Generate requests per API key per minute (0 disables)
+    rate_limit_burst: int = 4  # Requests an API key may send back-to-back
 
     # Server Configuration
     host: str = "0.0.0.0"
     port: int = 8000
 
-    @property
-    def valid_api_key_hashes(self) -> list[str]:
-        """Get all valid API key hashes (from keys file)."""
-        hashes = []
-        # First, check env var `API_KEY_HASHES` (comma-separated)
-        if self.api_key_hashes:
-            hashes.extend([h.strip() for h in self.api_key_hashes.split(",") if h.strip()])
-
-        # Then, fallback to file-based hashes. Treat relative paths as
-        # repository-root-relative so the app finds the same file regardless
-        # of current working directory.
-        repo_root = Path(__file__).resolve().parents[1]
-        path = Path(self.api_keys_path)
-        if not path.is_absolute():
-            path = (repo_root / path).resolve()
-        if path.exists():
-            try:
-                file_hashes = path.read_text().splitlines()
-                hashes.extend([h.strip() for h in file_hashes if h.strip()])
-            except Exception:
-                pass
 
-        # Also allow an env var `API_KEYS_FILE` to override path
-        env_path = os.getenv("API_KEYS_FILE")
-        if env_path:
-            p = Path(env_path)
-            if not p.is_absolute():
-                p = (repo_root / p).resolve()
-            if p.exists():
-                try:
-                    file_hashes = p.read_text().splitlines()
-                    hashes.extend([h.strip() for h in file_hashes if h.strip()])
-                except Exception:
-                    pass
-        # Note: if a SQLite DB is configured, it will be used instead of file-based
-        # lookup (see app/core/keys.py). This property preserves backward-compatibility
-        # for code that wants a simple list of hashes.
-        return list(set(hashes))
+# Immutable, slotted twin of `Settings` handed out at runtime. Attribute reads
+# are plain slot lookups instead of going through Pydantic's model machinery.
+FrozenSettings = make_dataclass(
+    "FrozenSettings",
+    [(name, field.annotation) for name, field in Settings.model_fields.items()],
+    bases=(_SettingsProperties,),
+    frozen=True,
+    slots=True,
+)
+FrozenSettings.__module__ = __name__
 
-    @property
-    def model_path_resolved(self) -> Path:
-        """Get the resolved model path."""
-        return Path(self.model_path).resolve()
 
+@lru_cache(maxsize=1)
+def get_settings() -> FrozenSettings:
+    """Get cached settings instance.
 
-@lru_cache
-def get_settings() -> Settings:
-    """Get cached settings instance."""
-    return Settings()
+    Values are validated once by Pydantic and then frozen into a
+    `FrozenSettings` snapshot.
+    """
+    return FrozenSettings(**Settings().model_dump())
@@ -1,23 +1,97 @@
 """API key authentication."""
 
+import asyncio
 import hashlib
-import hmac
 import logging
-from pathlib import Path
+import secrets
 from typing import Annotated
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import APIKeyHeader
 
 from app.config import get_settings
-from app.core.keys import KeyStore
+from app.core.cache import TTLCache
+from app.core.keys import REVOCATION_LAG_S, get_keystore, key_hasher, on_key_deleted
 
 logger = logging.getLogger(__name__)
 
+# Settings are frozen after startup; bind them once instead of per request.
+settings = get_settings()
+
+# SQLite key DB resolved against the repo root once, not on every request
+_DB_PATH = (
+    str(settings.api_keys_db_resolved) if settings.api_keys_db_resolved else None
+)
+
+# Recently verified keys, so repeat requests skip the SQLite lookup and hashing.
+# Entries are keyed by a BLAKE2b MAC under a per-process secret to avoid
+# retaining plaintext keys (or digests reproducible outside this process). The
+# TTL is half of REVOCATION_LAG_S; the key store's snapshot takes the other half.
+_verified_keys: TTLCache[bytes, bool] = TTLCache(
+    maxsize=1024, ttl=REVOCATION_LAG_S / 2
+)
+_CACHE_SECRET = secrets.token_bytes(32)
+
+
+def _cache_key(api_key: bytes) -> bytes:
+    """Derive the verified-key cache entry for a raw (encoded) API key."""
+    return hashlib.blake2b(api_key, key=_CACHE_SECRET, digest_size=16).digest()
+
+
+def tenant_id(api_key: str) -> bytes:
+    """Opaque per-key id used for queue fairness, never the key itself.
+
+    Same keyed digest as the verified-key cache, so nothing downstream of
+    authentication has to hold the plaintext key.
+    """
+    return _cache_key(api_key.encode())
+
+
+on_key_deleted(
+    lambda raw_key: _verified_keys.discard(_cache_key(raw_key.encode()))
+)
+
+_MAX_API_KEY_BYTES = 256
+
+
+class _APIKeyHeader(APIKeyHeader):
+    """`APIKeyHeader` that reads the raw ASGI header and bounds its length.
+
+    Keeps the OpenAPI security scheme of the stock class, but scans the raw
+    header list for the lowercased ``name`` and rejects absurdly long keys
+    (DoS via large headers) before decoding them.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # ASGI header names arrive lowercased as bytes
+        self._raw_name = self.model.name.lower().encode("latin-1")
+
+    async def __call__(self, request: Request) -> str | None:
+        for name, value in request.scope["headers"]:
+            if name == self._raw_name:
+                break
+        else:
+            value = b""
+
+        if not value:
+            # Stock handling: 401 with the standard challenge, or None when
+            # auto_error is off
+            return await super().__call__(request)
+        if len(value) > _MAX_API_KEY_BYTES:
+            logger.warning("API key too long")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid API key",
+            )
+        return value.decode("latin-1")
+
+
 # API key header scheme
-api_key_header = APIKeyHeader(
+api_key_header = _APIKeyHeader(
     name="X-API-Key",
     description="API key for authentication",
+    scheme_name="APIKeyHeader",
     auto_error=True,
 )
 
@@ -35,55 +109,43 @@ async def verify_api_key(
     Raises:
         HTTPException: If the API key is invalid.
     """
-    settings = get_settings()
+    api_key_bytes = api_key.encode()
+    cache_key = _cache_key(api_key_bytes)
+    if _verified_keys.get(cache_key):
+        return api_key
+
     # If a SQLite DB is configured, prefer DB-backed verification for
     # performance and centralized storage.
-    db_path = settings.api_keys_db
-    if db_path:
-        # resolve relative path against repo root
-        repo_root = Path(__file__).resolve().parents[2]
-        p = Path(db_path)
-        if not p.is_absolute():
-            p = (repo_root / p).resolve()
-        
-        logger.info(f"Verifying API key using database at: {p}")
+    if _DB_PATH:
         try:
-            ks = KeyStore(p)
-            ok = ks.verify(api_key)
-            ks.close()
-            if ok:
+            # A snapshot reload or miss reads SQLite; do it in a worker thread
+            # (each with its own reader connection) so the event loop never blocks.
+            if await asyncio.to_thread(get_keystore(_DB_PATH).verify, api_key):
+                _verified_keys.set(cache_key, True)
                 return api_key
         except Exception:
             # Fall back to previous file/env-based behaviour on error
-            logger.exception(f"KeyStore error using {p} — falling back to file-based checks")
-
-    # Reject absurdly long keys early to mitigate DoS via large headers
-    if len(api_key) > 256:
-        logger.warning("API key too long")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid API key",
-        )
+            logger.exception(
+                "KeyStore error using %s — falling back to file-based checks", _DB_PATH
+            )
 
     # Hash the incoming key to compare with stored hashes. If a server-side
     # pepper is configured, use HMAC-SHA256 with the pepper as the key. This
     # prevents an attacker who obtains the stored hashes from verifying keys
     # offline without access to the server secret.
-    if settings.api_key_pepper:
-        hashed_input = hmac.new(
-            settings.api_key_pepper.encode(), api_key.encode(), hashlib.sha256
-        ).hexdigest()
-    else:
-        hashed_input = hashlib.sha256(api_key.encode()).hexdigest()
-
-    # Use constant-time comparison to avoid timing attacks
-    for stored in settings.valid_api_key_hashes:
-        if hmac.compare_digest(hashed_input, stored):
-            return api_key
+    hasher = key_hasher(settings.api_key_pepper).copy()
+    hasher.update(api_key_bytes)
+    hashed_input = hasher.digest()
+
+    # Stored values are fixed-length digests of the key, so a set lookup
+    # reveals nothing useful about the key compared to a per-hash compare.
+    if hashed_input in settings.valid_api_key_hashes:
+        _verified_keys.set(cache_key, True)
+        return api_key
 
     logger.warning("Invalid API key attempt")
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid API key",
-        headers={"WWW-Authenticate": "ApiKey"},
+        headers={"WWW-Authenticate": "APIKey"},
     )
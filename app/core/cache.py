@@ -0,0 +1,64 @@
+"""Small in-process caches for hot request paths."""
+
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Bounded LRU mapping whose entries optionally expire after ``ttl`` seconds.
+
+    Not thread-safe: intended to be used from the event loop thread only.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        """Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of entries kept (0 disables caching).
+            ttl: Seconds an entry stays valid, or None to never expire.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        """Return the cached value for ``key`` if present and not expired."""
+        item = self._data.get(key)
+        if item is None:
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        """Store ``value``, evicting the least recently used entries if full."""
+        if self.maxsize <= 0:
+            return
+
+        expires_at = (
+            time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        )
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, key: K) -> None:
+        """Remove ``key`` if cached."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        self._data.clear()
@@ -8,23 +8,115 @@ Design notes:
 import hmac
 import hashlib
 import sqlite3
+import threading
 import time
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable
 
 from app.config import get_settings
 
+# Callbacks invoked with the raw key after it is deleted, so in-process
+# caches of verified keys can drop it immediately.
+_delete_hooks: list[Callable[[str], None]] = []
+
+
+# Bumped whenever `_init_db` changes the schema; recorded in PRAGMA user_version
+# so already-initialized databases skip the DDL on open.
+_SCHEMA_VERSION = 1
+
+# Fixed SQL text so sqlite3's per-connection statement cache reuses the
+# prepared statements instead of re-parsing them on every call.
+_INSERT_SQL = "INSERT INTO api_keys (prefix, hash, created_at, owner) VALUES (?, ?, ?, ?)"
+_VERIFY_SQL = (
+    "SELECT 1 FROM api_keys WHERE prefix = ? AND hash = ? AND revoked = 0 LIMIT 1"
+)
+_DELETE_SQL = "DELETE FROM api_keys WHERE prefix = ? AND hash = ?"
+_SNAPSHOT_SQL = "SELECT prefix, hash FROM api_keys WHERE revoked = 0"
+
+# Longest a key deleted or revoked by another process keeps authenticating.
+# The active-key snapshot and auth's verified-key cache each get half: a cache
+# entry can be refreshed from a snapshot that is itself stale, so their TTLs
+# stack. Deletes made through this process take effect immediately.
+REVOCATION_LAG_S = 60.0
+
+# How long an in-memory snapshot of active keys is trusted before it is reloaded
+_SNAPSHOT_TTL_S = REVOCATION_LAG_S / 2
+
+
+def on_key_deleted(hook: Callable[[str], None]) -> None:
+    """Register a callback invoked with the raw key after it is deleted."""
+    _delete_hooks.append(hook)
+
+
+@lru_cache(maxsize=4)
+def key_hasher(pepper: str | None):
+    """Return the keyed hash state for ``pepper``, to be ``copy()``-ed per use.
+
+    Building an HMAC derives the inner/outer pads from the key; doing that
+    once and copying the state skips that work on every hash.
+    """
+    if pepper:
+        return hmac.new(pepper.encode(), digestmod=hashlib.sha256)
+    return hashlib.sha256()
+
+
+@lru_cache(maxsize=4)
+def get_keystore(db_path: str) -> "KeyStore":
+    """Return the process-wide KeyStore for ``db_path``, opening it on first use."""
+    return KeyStore(db_path)
+
 
 class KeyStore:
-    def __init__(self, db_path: str | Path):
+    def __init__(self, db_path: str | Path, pepper: str | None = None):
         self.db_path = Path(db_path)
+        if pepper is None:
+            pepper = get_settings().api_key_pepper
+        # Bound once so add/verify/delete don't consult settings per call
+        self._hasher = key_hasher(pepper)
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        # allow access from multiple threads within the same process
-        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        # Shared writer connection; the lock serializes writes through it.
+        # Reads use per-thread connections so they can run in parallel in WAL mode.
+        self.conn = self._connect()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._readers: list[sqlite3.Connection] = []
+        # (loaded_at, prefix -> active hashes); None until first verify
+        self._snapshot: tuple[float, dict[str, frozenset[bytes]]] | None = None
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close() can reach every connection
+        conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, cached_statements=128
+        )
+        # Per-connection tuning for a small, read-mostly table
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-2000")  # 2 MB
+        conn.execute("PRAGMA mmap_size=30000000")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Return the calling thread's read-only connection, opening it if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
     def _init_db(self) -> None:
         cur = self.conn.cursor()
+
+        # Schema and persistent settings only need applying once per file
+        (version,) = cur.execute("PRAGMA user_version").fetchone()
+        if version >= _SCHEMA_VERSION:
+            return
+
+        cur.execute("PRAGMA page_size=4096")  # only effective before first write
         cur.execute("PRAGMA journal_mode=WAL")
         cur.execute(
             """
@@ -39,55 +131,79 @@ class KeyStore:
             """
         )
         cur.execute("CREATE INDEX IF NOT EXISTS ix_keys_prefix ON api_keys(prefix)")
+        # Covers verify(): active keys looked up by prefix and hash together
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS ix_keys_prefix_hash ON api_keys(prefix, hash) "
+            "WHERE revoked = 0"
+        )
+        cur.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
         self.conn.commit()
 
+    def _compute_hash(self, raw: bytes) -> bytes:
+        h = self._hasher.copy()
+        h.update(raw)
+        return h.digest()
+
     @staticmethod
-    def _compute_hash(raw: str, pepper: str | None) -> bytes:
-        if pepper:
-            return hmac.new(pepper.encode(), raw.encode(), hashlib.sha256).digest()
-        return hashlib.sha256(raw.encode()).digest()
+    def _prefix_of(raw_key: str) -> str:
+        # partition() avoids building a list of parts; the prefix stays a str
+        # to match the TEXT column.
+        head, sep, _ = raw_key.partition("_")
+        return head if sep else "_"  # fallback
+
+    def snapshot(self) -> dict[str, frozenset[bytes]]:
+        """Load every active key hash, grouped by prefix."""
+        grouped: dict[str, set[bytes]] = {}
+        for prefix, stored_hash in self._reader().execute(_SNAPSHOT_SQL):
+            grouped.setdefault(prefix, set()).add(stored_hash)
+        return {prefix: frozenset(hashes) for prefix, hashes in grouped.items()}
+
+    def _active_keys(self) -> dict[str, frozenset[bytes]]:
+        snap = self._snapshot
+        now = time.monotonic()
+        if snap is None or now - snap[0] > _SNAPSHOT_TTL_S:
+            snap = (now, self.snapshot())
+            self._snapshot = snap
+        return snap[1]
 
     def add_key(self, raw_key: str, prefix: str | None = None, owner: str | None = None) -> None:
         if prefix is None:
-            if "_" in raw_key:
-                prefix = raw_key.split("_", 1)[0]
-            else:
-                prefix = "_"  # fallback
+            prefix = self._prefix_of(raw_key)
 
-        settings = get_settings()
-        b = self._compute_hash(raw_key, settings.api_key_pepper)
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO api_keys (prefix, hash, created_at, owner) VALUES (?, ?, ?, ?)",
-            (prefix, b, int(time.time()), owner),
-        )
-        self.conn.commit()
+        b = self._compute_hash(raw_key.encode())
+        with self._lock:
+            self.conn.execute(_INSERT_SQL, (prefix, b, int(time.time()), owner))
+            self.conn.commit()
+        self._snapshot = None
 
     def verify(self, raw_key: str) -> bool:
-        # Extract prefix and lookup candidates
-        if "_" in raw_key:
-            prefix = raw_key.split("_", 1)[0]
-        else:
-            prefix = "_"
+        # The prefix is non-secret and the hash is an opaque digest, so the
+        # equality match can run inside SQLite on the partial index.
+        prefix = self._prefix_of(raw_key)
+        computed = self._compute_hash(raw_key.encode())
+        if computed in self._active_keys().get(prefix, ()):
+            return True
+        # Not in the snapshot: the key may have been added by another process
+        row = self._reader().execute(_VERIFY_SQL, (prefix, computed)).fetchone()
+        return row is not None
 
-        cur = self.conn.cursor()
-        cur.execute("SELECT hash, revoked FROM api_keys WHERE prefix = ?", (prefix,))
-        rows: List[Tuple[bytes, int]] = cur.fetchall()
-        if not rows:
-            return False
-
-        settings = get_settings()
-        computed = self._compute_hash(raw_key, settings.api_key_pepper)
-        for stored_hash, revoked in rows:
-            if revoked:
-                continue
-            # constant-time comparison
-            if hmac.compare_digest(computed, stored_hash):
-                return True
-        return False
+    def delete_key(self, raw_key: str) -> bool:
+        b = self._compute_hash(raw_key.encode())
+        with self._lock:
+            cur = self.conn.execute(_DELETE_SQL, (self._prefix_of(raw_key), b))
+            self.conn.commit()
+        self._snapshot = None
+        deleted = cur.rowcount > 0
+        if deleted:
+            for hook in _delete_hooks:
+                hook(raw_key)
+        return deleted
 
     def close(self) -> None:
-        try:
-            self.conn.close()
-        except Exception:
-            pass
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for conn in (self.conn, *readers):
+            try:
+                conn.close()
+            except Exception:
+                pass
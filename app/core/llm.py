@@ -1,19 +1,27 @@
 """LLM manager for Ollama-based inference."""
 
 import logging
+import re
 import time
 from typing import Iterator
 
 import ollama
-from app.config import Settings
+from app.config import FrozenSettings
 
 logger = logging.getLogger(__name__)
 
+_WORD_RE = re.compile(r"\S+")
+
+
+def _count_words(text: str) -> int:
+    """Count whitespace-separated words without materializing them as a list."""
+    return sum(1 for _ in _WORD_RE.finditer(text))
+
 
 class LLMManager:
     """Manages the Ollama LLM lifecycle and inference."""
 
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: FrozenSettings):
         """Initialize the LLM manager.
 
         Args:
@@ -23,6 +31,15 @@ class LLMManager:
         self.model_name = settings.ollama_model
         self._client = None
         self._is_loaded = False
+        # Options that only change when a caller overrides them; copied per request
+        self._base_options = {
+            "num_predict": settings.max_tokens,
+            "num_thread": settings.n_threads,
+            "num_ctx": settings.n_ctx,
+            "num_batch": settings.n_batch,
+        }
+        if settings.ollama_mlock:
+            self._base_options["use_mlock"] = True
 
     @property
     def is_loaded(self) -> bool:
@@ -37,9 +54,7 @@ class LLMManager:
             # Check if Ollama is reachable
             logger.info("Connecting to Ollama...")
             models = self._client.list()
-            model_names = (
-                [m.model for m in models.models] if hasattr(models, "models") else []
-            )
+            model_names = {m.model for m in getattr(models, "models", None) or ()}
 
             if self.model_name not in model_names:
                 logger.info(f"Model {self.model_name} not found. Pulling...")
@@ -60,50 +75,6 @@ class LLMManager:
         self._is_loaded = False
         logger.info("Model unloaded")
 
-    def generate(
-        self,
-        prompt: str,
-        system: str | None = None,
-        max_tokens: int | None = None,
-        temperature: float = 0.7,
-        top_p: float = 0.9,
-        top_k: int = 40,
-        stop: list[str] | None = None,
-        n_ctx: int | None = None,
-        n_threads: int | None = None,
-    ) -> dict:
-        """Generate text from prompt (non-streaming).
-
-        Args:
-            prompt: The input prompt.
-            system: Optional system prompt to guide the model's behavior.
-            max_tokens: Maximum tokens to generate.
-            temperature: Sampling temperature.
-            top_p: Top-p sampling parameter.
-            top_k: Top-k sampling parameter.
-            stop: Stop sequences.
-
-        Returns:
-            Dictionary with generated text and token counts.
-
-        Raises:
-            RuntimeError: If Ollama is not connected.
-        """
-        if not self._is_loaded or not self._client:
-            raise RuntimeError("Ollama not connected")
-
-        return self.generate_with_metrics(
-            prompt=prompt,
-            system=system,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            top_k=top_k,
-            stop=stop,
-            n_ctx=n_ctx,
-            n_threads=n_threads,
-        )
-
     def generate_with_metrics(
         self,
         prompt: str,
@@ -140,8 +111,8 @@ class LLMManager:
         latency_s = max(time.perf_counter() - started, 1e-9)
 
         text = response.get("message", {}).get("content", "")
-        prompt_tokens = int(response.get("prompt_eval_count") or len(prompt.split()))
-        completion_tokens = int(response.get("eval_count") or len(text.split()))
+        prompt_tokens = int(response.get("prompt_eval_count") or _count_words(prompt))
+        completion_tokens = int(response.get("eval_count") or _count_words(text))
         total_tokens = prompt_tokens + completion_tokens
 
         load_duration = response.get("load_duration")
@@ -181,6 +152,10 @@ class LLMManager:
             ),
         }
 
+    # Non-streaming generation is the metrics path; alias it rather than
+    # forwarding through an extra call frame.
+    generate = generate_with_metrics
+
     def generate_stream(
         self,
         prompt: str,
@@ -192,8 +167,13 @@ class LLMManager:
         stop: list[str] | None = None,
         n_ctx: int | None = None,
         n_threads: int | None = None,
+        usage: dict | None = None,
     ) -> Iterator[str]:
-        """Generate text from prompt with streaming."""
+        """Generate text from prompt with streaming.
+
+        If ``usage`` is given, it is filled with the ``prompt_tokens`` and
+        ``completion_tokens`` Ollama reports in its final chunk.
+        """
         if not self._is_loaded or not self._client:
             raise RuntimeError("Ollama not connected")
 
@@ -216,9 +196,14 @@ class LLMManager:
         stream = self._client.chat(**request_params)
 
         for chunk in stream:
-            content = chunk.get("message", {}).get("content", "")
-            if content:
-                yield content
+            message = chunk.get("message")
+            if message:
+                content = message.get("content")
+                if content:
+                    yield content
+            if usage is not None and chunk.get("done"):
+                usage["prompt_tokens"] = chunk.get("prompt_eval_count")
+                usage["completion_tokens"] = chunk.get("eval_count")
 
     def get_token_count(self, text: str) -> int:
         """Count the number of tokens in the given text (estimated).
@@ -230,7 +215,7 @@ class LLMManager:
             Estimated number of tokens.
         """
         # Rough estimate: ~0.75 tokens per word on average
-        return int(len(text.split()) * 1.3)
+        return int(_count_words(text) * 1.3)
 
     def _build_messages(self, prompt: str, system: str | None) -> list[dict[str, str]]:
         """Create chat-formatted messages."""
@@ -251,15 +236,20 @@ class LLMManager:
         n_threads: int | None = None,
     ) -> dict:
         """Build Ollama generation options with Pi-friendly defaults."""
-        return {
-            "num_predict": max_tokens if max_tokens is not None else self.settings.max_tokens,
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "num_thread": n_threads if n_threads is not None else self.settings.n_threads,
-            "num_ctx": n_ctx if n_ctx is not None else self.settings.n_ctx,
-            "stop": stop or [],
-        }
+        options = self._base_options.copy()
+        options["temperature"] = temperature
+        options["top_p"] = top_p
+        options["top_k"] = top_k
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if n_threads is not None:
+            options["num_thread"] = n_threads
+        if n_ctx is not None:
+            options["num_ctx"] = n_ctx
+        # A fresh list per request: the template is only shallow-copied, so a
+        # shared list would let one caller's edits leak into later requests
+        options["stop"] = list(stop) if stop else []
+        return options
 
     def _warmup(self) -> None:
         """Warm the model so first user request has lower latency."""
@@ -272,10 +262,9 @@ class LLMManager:
                 model=self.model_name,
                 messages=[{"role": "user", "content": "hi"}],
                 options={
+                    **self._base_options,
                     "num_predict": 1,
                     "temperature": 0.0,
-                    "num_thread": self.settings.n_threads,
-                    "num_ctx": self.settings.n_ctx,
                 },
                 keep_alive=self.settings.ollama_keep_alive,
             )
@@ -1,16 +1,29 @@
 """Async request queue for managing inference requests."""
 
 import asyncio
+import heapq
+import itertools
 import logging
 import time
 import uuid
+from collections import deque
 from dataclasses import dataclass, field
 from typing import AsyncIterator
 
 logger = logging.getLogger(__name__)
 
+# Queue ordering charges each request this many prompt characters per second
+# of virtual wait, so short prompts overtake long ones by a bounded amount
+# (an 8k-character prompt yields ~8s) and nothing starves.
+_QUEUE_CHARS_PER_S = 1000.0
 
-@dataclass
+# Deficit round robin across tenants: each turn a tenant earns _DRR_QUANTUM
+# credit and every dequeued request costs _DRR_REQUEST_COST.
+_DRR_QUANTUM = 1
+_DRR_REQUEST_COST = 1
+
+
+@dataclass(slots=True)
 class InferenceRequest:
     """Represents a single inference request in the queue."""
 
@@ -22,14 +35,38 @@ class InferenceRequest:
     top_k: int = 40
     stop: list[str] = field(default_factory=list)
     stream: bool = True
+    priority: int = 1  # Lower values are dequeued first
+    tenant: bytes = b""  # Fair-share bucket in the queue (digest of the API key)
+    # Slow-consumer guard: cancel once more than `max_backlog` tokens have been
+    # waiting for longer than `backlog_timeout_s` (0 disables).
+    max_backlog: int = 0
+    backlog_timeout_s: float = 0.0
 
     # Internal state
     id: str = field(default_factory=lambda: str(uuid.uuid4())[:8])
     created_at_monotonic: float = field(default_factory=time.monotonic)
-    _token_queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    # Single producer/consumer on the event loop thread: a deque plus a wakeup
+    # event is all the synchronization the token stream needs.
+    _tokens: deque[str] = field(default_factory=deque)
+    _signal: asyncio.Event = field(default_factory=asyncio.Event)
     _done: asyncio.Event = field(default_factory=asyncio.Event)
     _stats: dict = field(default_factory=dict)
     _error: Exception | None = field(default=None)
+    _cancelled: bool = field(default=False)
+    _backlog_since: float | None = field(default=None)
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the consumer gave up on this request."""
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """Ask the producer to stop generating tokens for this request.
+
+        Safe to call from any thread; the generation loop checks the flag
+        between tokens.
+        """
+        self._cancelled = True
 
     async def put_token(self, token: str) -> None:
         """Add a generated token to the stream.
@@ -37,7 +74,38 @@ class InferenceRequest:
         Args:
             token: The generated token.
         """
-        await self._token_queue.put(token)
+        self._tokens.append(token)
+        self._signal.set()
+        self._check_backlog()
+
+    def put_tokens(self, tokens: list[str]) -> None:
+        """Add a batch of generated tokens to the stream.
+
+        Must run on the event loop thread; producers in other threads schedule
+        it with ``loop.call_soon_threadsafe``.
+
+        Args:
+            tokens: Generated tokens, in order.
+        """
+        self._tokens.extend(tokens)
+        self._signal.set()
+        self._check_backlog()
+
+    def _check_backlog(self) -> None:
+        """Cancel generation if the consumer has stopped draining tokens."""
+        if not self.max_backlog or len(self._tokens) <= self.max_backlog:
+            self._backlog_since = None
+            return
+
+        now = time.monotonic()
+        if self._backlog_since is None:
+            self._backlog_since = now
+        elif now - self._backlog_since > self.backlog_timeout_s and not self._cancelled:
+            logger.warning("Request %s cancelled: client too slow", self.id)
+            self._error = TimeoutError(
+                "Client is reading too slowly; generation cancelled."
+            )
+            self.cancel()
 
     async def complete(self, stats: dict) -> None:
         """Mark the request as complete.
@@ -46,8 +114,8 @@ class InferenceRequest:
             stats: Token statistics (prompt_tokens, completion_tokens, total_tokens).
         """
         self._stats = stats
-        await self._token_queue.put(None)  # Sentinel value
         self._done.set()
+        self._signal.set()
 
     async def fail(self, error: Exception) -> None:
         """Mark the request as failed.
@@ -56,8 +124,8 @@ class InferenceRequest:
             error: The exception that caused the failure.
         """
         self._error = error
-        await self._token_queue.put(None)  # Sentinel value
         self._done.set()
+        self._signal.set()
 
     async def token_stream(self) -> AsyncIterator[str]:
         """Iterate over generated tokens as they become available.
@@ -68,13 +136,55 @@ class InferenceRequest:
         Raises:
             Exception: If the request failed with an error.
         """
+        tokens = self._tokens
         while True:
-            token = await self._token_queue.get()
-            if token is None:  # Sentinel value
+            while tokens:
+                yield tokens.popleft()
+            self._backlog_since = None  # Consumer caught up
+            if self._done.is_set():
                 if self._error:
                     raise self._error
                 break
-            yield token
+            self._signal.clear()
+            await self._signal.wait()
+
+    async def next_batch(
+        self, timeout: float | None, limit: int | None = None
+    ) -> list[str] | None:
+        """Wait up to ``timeout`` seconds for tokens and take the pending ones.
+
+        Args:
+            timeout: Seconds to wait when nothing is pending (None waits forever).
+            limit: Maximum number of tokens to take; the rest stay buffered.
+
+        Returns:
+            The pending tokens, an empty list if none arrived in time, or None
+            once the stream is finished.
+
+        Raises:
+            Exception: If the request failed with an error.
+        """
+        tokens = self._tokens
+        if not tokens and not self._done.is_set():
+            self._signal.clear()
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._signal.wait()
+            except TimeoutError:
+                return []
+
+        if tokens:
+            if limit is None or len(tokens) <= limit:
+                batch = list(tokens)
+                tokens.clear()
+            else:
+                batch = [tokens.popleft() for _ in range(limit)]
+            if len(tokens) <= self.max_backlog:
+                self._backlog_since = None  # Consumer caught up
+            return batch
+        if self._error:
+            raise self._error
+        return None
 
     async def get_stats(self) -> dict:
         """Get token statistics after completion.
@@ -87,33 +197,46 @@ class InferenceRequest:
 
 
 class RequestQueue:
-    """Async queue for managing inference requests."""
+    """Async fair-share queue for managing inference requests.
+
+    Each tenant has its own sub-queue, and tenants are served by deficit round
+    robin, so a burst from one API key can't hold everyone else's requests
+    behind it. Within a tenant, requests are ordered by ``priority``, then by
+    arrival time pushed back in proportion to prompt length, so a long prefill
+    doesn't hold short interactive requests behind it.
+    """
 
     def __init__(self, maxsize: int = 100):
         """Initialize the request queue.
 
         Args:
-            maxsize: Maximum number of pending requests.
+            maxsize: Maximum number of pending requests across all tenants.
         """
-        self._queue: asyncio.Queue[InferenceRequest] = asyncio.Queue(maxsize=maxsize)
+        self._maxsize = maxsize
+        self._size = 0
+        self._subqueues: dict[bytes, list[tuple[int, float, int, InferenceRequest]]] = {}
+        self._active: deque[bytes] = deque()  # Tenants with pending requests, in turn order
+        self._deficit: dict[bytes, int] = {}
+        self._not_empty = asyncio.Event()
+        self._seq = itertools.count()  # FIFO tie-break; requests aren't comparable
 
     @property
     def size(self) -> int:
         """Get the current queue size."""
-        return self._queue.qsize()
+        return self._size
 
     @property
     def maxsize(self) -> int:
         """Get configured queue capacity."""
-        return self._queue.maxsize
+        return self._maxsize
 
     @property
     def is_full(self) -> bool:
         """Check whether the queue is at capacity."""
-        return self.maxsize > 0 and self.size >= self.maxsize
+        return self._maxsize > 0 and self._size >= self._maxsize
 
     async def put(self, request: InferenceRequest) -> None:
-        """Add a request to the queue.
+        """Add a request to its tenant's sub-queue.
 
         Args:
             request: The inference request to queue.
@@ -121,19 +244,58 @@ class RequestQueue:
         if self.is_full:
             raise asyncio.QueueFull
 
-        self._queue.put_nowait(request)
-        logger.debug(f"Request {request.id} queued (queue size: {self.size})")
+        tenant = request.tenant
+        subqueue = self._subqueues.get(tenant)
+        if subqueue is None:
+            subqueue = self._subqueues[tenant] = []
+            # The head tenant always holds its current turn's credit
+            self._deficit[tenant] = 0 if self._active else _DRR_QUANTUM
+            self._active.append(tenant)
+
+        prompt_chars = len(request.prompt) + len(request.system or "")
+        heapq.heappush(
+            subqueue,
+            (
+                request.priority,
+                request.created_at_monotonic + prompt_chars / _QUEUE_CHARS_PER_S,
+                next(self._seq),
+                request,
+            ),
+        )
+        self._size += 1
+        self._not_empty.set()
+        logger.debug("Request %s queued (queue size: %s)", request.id, self._size)
 
     async def get(self) -> InferenceRequest:
-        """Get the next request from the queue.
+        """Wait for and take the next request in deficit round robin order.
 
         Returns:
             The next inference request.
         """
-        request = await self._queue.get()
-        logger.debug(f"Request {request.id} dequeued (queue size: {self.size})")
-        return request
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
 
-    def task_done(self) -> None:
-        """Mark the current task as done."""
-        self._queue.task_done()
+        active = self._active
+        tenant = active[0]
+        if self._deficit[tenant] < _DRR_REQUEST_COST:
+            # Head tenant spent its credit: pass the turn to the next one
+            active.rotate(-1)
+            tenant = active[0]
+            self._deficit[tenant] += _DRR_QUANTUM
+
+        self._deficit[tenant] -= _DRR_REQUEST_COST
+        subqueue = self._subqueues[tenant]
+        *_, request = heapq.heappop(subqueue)
+        if not subqueue:
+            # Idle tenants drop out and forfeit leftover credit; the next
+            # tenant's turn starts now
+            active.popleft()
+            del self._subqueues[tenant]
+            del self._deficit[tenant]
+            if active:
+                self._deficit[active[0]] += _DRR_QUANTUM
+
+        self._size -= 1
+        logger.debug("Request %s dequeued (queue size: %s)", request.id, self._size)
+        return request
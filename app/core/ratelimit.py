@@ -0,0 +1,55 @@
+"""Per-key token bucket admission control."""
+
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class RateLimiter:
+    """Token bucket per key: ``burst`` requests at once, refilled at ``rate``/s.
+
+    Idle buckets refill to full, so only the most recently used ``maxsize``
+    keys are tracked. Keys are kept in memory, so pass a digest (e.g. the
+    request tenant id) rather than a secret. Not thread-safe: intended to be
+    used from the event loop thread only.
+    """
+
+    def __init__(self, rate: float, burst: int, maxsize: int = 1024):
+        """Initialize the limiter.
+
+        Args:
+            rate: Tokens added to each bucket per second.
+            burst: Bucket capacity (requests allowed back-to-back).
+            maxsize: Maximum number of keys tracked at once.
+        """
+        self.rate = rate
+        self.burst = float(max(1, burst))
+        self.maxsize = maxsize
+        self._buckets: OrderedDict[Hashable, tuple[float, float]] = OrderedDict()
+
+    def try_acquire(self, key: Hashable, cost: float = 1.0) -> bool:
+        """Take ``cost`` tokens from ``key``'s bucket if it has them."""
+        now = time.monotonic()
+        item = self._buckets.get(key)
+        if item is None:
+            tokens = self.burst
+        else:
+            tokens, refilled_at = item
+            tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def refund(self, key: Hashable, cost: float = 1.0) -> None:
+        """Return ``cost`` tokens taken for a request that was not admitted."""
+        item = self._buckets.get(key)
+        if item is not None:
+            tokens, refilled_at = item
+            self._buckets[key] = (min(self.burst, tokens + cost), refilled_at)
@@ -1,16 +1,30 @@
 """FastAPI application entry point."""
 
 import asyncio
+import importlib.util
 import logging
 from contextlib import asynccontextmanager
+from functools import lru_cache
 
+import orjson
 import uvicorn
 from fastapi import FastAPI
+from fastapi.openapi.docs import (
+    get_redoc_html,
+    get_swagger_ui_html,
+    get_swagger_ui_oauth2_redirect_html,
+)
+from fastapi.responses import HTMLResponse, Response
 
+from app.api.middleware import BodySizeLimitMiddleware
+from app.api.responses import OrjsonResponse
 from app.api.routes import router
 from app.config import get_settings
+from app.core.cache import TTLCache
+from app.core.keys import KeyStore, get_keystore
 from app.core.llm import LLMManager
 from app.core.queue import RequestQueue
+from app.core.ratelimit import RateLimiter
 from app.services.inference import InferenceService
 
 # Configure logging
@@ -48,6 +62,15 @@ async def lifespan(app: FastAPI):
             f"Startup aborted: failed to load required model '{llm_manager.model_name}'"
         ) from e
 
+    # Open the API key store once and share its connection across requests
+    keystore: KeyStore | None = None
+    db_path = settings.api_keys_db_resolved
+    if db_path:
+        try:
+            keystore = get_keystore(str(db_path))
+        except Exception as e:
+            logger.error(f"Failed to open API key store at {db_path}: {e}")
+
     # Initialize request queue (for overflow when all threads are busy)
     request_queue = RequestQueue(maxsize=settings.max_queue_size)
 
@@ -56,6 +79,12 @@ async def lifespan(app: FastAPI):
         llm_manager,
         request_queue,
         max_concurrent=settings.max_concurrent_requests,
+        rate_limiter=RateLimiter(
+            rate=settings.rate_limit_per_minute / 60,
+            burst=settings.rate_limit_burst,
+        )
+        if settings.rate_limit_per_minute > 0
+        else None,
     )
     worker_task = asyncio.create_task(inference_service.run())
     logger.info(
@@ -65,9 +94,15 @@ async def lifespan(app: FastAPI):
     )
 
     # Store in app state for access in routes
+    app.state.settings = settings
     app.state.llm_manager = llm_manager
     app.state.request_queue = request_queue
     app.state.inference_service = inference_service
+    app.state.response_cache = TTLCache(maxsize=settings.response_cache_size)
+    app.state.keystore = keystore
+    app.state.keystore_lock = asyncio.Lock()
+    # Render the OpenAPI schema now rather than on the first /openapi.json
+    _openapi_bytes()
 
     yield
 
@@ -86,6 +121,10 @@ async def lifespan(app: FastAPI):
     if llm_manager:
         llm_manager.unload_model()
 
+    if keystore:
+        keystore.close()
+        get_keystore.cache_clear()
+
     logger.info("Shutdown complete")
 
 
@@ -95,12 +134,57 @@ app = FastAPI(
     description="On-Demand LLM on Raspberry Pi 5 with Ollama-managed models",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=OrjsonResponse,
+    # Schema and docs routes are registered below to serve the pre-rendered schema
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
+)
+
+# Refuse oversized bodies before they are read or parsed
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    max_body_bytes=get_settings().max_body_bytes,
 )
 
 # Include API routes
 app.include_router(router)
 
 
+@lru_cache(maxsize=1)
+def _openapi_bytes() -> bytes:
+    """Render the OpenAPI schema once; later calls return the same bytes."""
+    return orjson.dumps(app.openapi())
+
+
+@app.get("/openapi.json", include_in_schema=False)
+async def openapi_json() -> Response:
+    """Serve the pre-rendered OpenAPI schema."""
+    return Response(_openapi_bytes(), media_type="application/json")
+
+
+@app.get("/docs", include_in_schema=False)
+async def swagger_ui() -> HTMLResponse:
+    """Serve Swagger UI backed by the pre-rendered schema."""
+    return get_swagger_ui_html(
+        openapi_url="/openapi.json",
+        title=f"{app.title} - Swagger UI",
+        oauth2_redirect_url="/docs/oauth2-redirect",
+    )
+
+
+@app.get("/docs/oauth2-redirect", include_in_schema=False)
+async def swagger_ui_redirect() -> HTMLResponse:
+    """Serve the Swagger UI OAuth2 redirect page FastAPI would register."""
+    return get_swagger_ui_oauth2_redirect_html()
+
+
+@app.get("/redoc", include_in_schema=False)
+async def redoc() -> HTMLResponse:
+    """Serve ReDoc backed by the pre-rendered schema."""
+    return get_redoc_html(openapi_url="/openapi.json", title=f"{app.title} - ReDoc")
+
+
 def run():
     """Run the server (entry point for CLI)."""
     settings = get_settings()
@@ -109,6 +193,9 @@ def run():
         host=settings.host,
         port=settings.port,
         reload=False,
+        # uvloop has no Windows build (see requirements); fall back there
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools",
     )
 
 
@@ -1,16 +1,46 @@
 """Inference service - manages concurrent inference with thread pool and queue fallback."""
 
 import asyncio
+import bisect
 import logging
 import time
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
-from statistics import mean
+from dataclasses import dataclass
 
 from app.core.llm import LLMManager
 from app.core.queue import InferenceRequest, RequestQueue
+from app.core.ratelimit import RateLimiter
 
 logger = logging.getLogger(__name__)
 
+# Streamed tokens are handed to the event loop in batches that start at one
+# token (for time to first token) and grow while tokens arrive faster than the
+# flush window, so fast generation wakes the loop less often.
+_TOKEN_BATCH_MIN = 1
+_TOKEN_BATCH_MAX = 16
+_TOKEN_BATCH_GROWTH = 2
+
+# Benchmark max_tokens recommendation: measured completion tokens/s below
+# each threshold maps to the cap at the same index.
+_RECOMMEND_TPS_THRESHOLDS = (4.0, 8.0, 12.0)
+_RECOMMEND_MAX_TOKENS = (64, 96, 128, 160)
+
+
+@dataclass(slots=True)
+class _BenchmarkProfile:
+    """Averaged metrics for one context size (``BenchmarkProfile`` shape).
+
+    orjson serializes it directly, so no dict is built for the response.
+    """
+
+    context_size: int
+    runs: int
+    avg_latency_ms: float
+    avg_ttft_ms: float | None
+    avg_completion_tokens: float
+    avg_completion_tokens_per_second: float
+
 
 class InferenceService:
     """Service that manages inference requests with multithreading and queue fallback.
@@ -24,6 +54,7 @@ class InferenceService:
         llm_manager: LLMManager,
         request_queue: RequestQueue,
         max_concurrent: int = 2,
+        rate_limiter: RateLimiter | None = None,
     ):
         """Initialize the inference service.
 
@@ -31,16 +62,27 @@ class InferenceService:
             llm_manager: The LLM manager instance.
             request_queue: The request queue for overflow.
             max_concurrent: Maximum concurrent inference requests.
+            rate_limiter: Optional admission limit checked first, keyed by
+                ``InferenceRequest.tenant`` (a key digest, never the raw key).
         """
         self.llm_manager = llm_manager
         self.request_queue = request_queue
         self.max_concurrent = max_concurrent
-        self._executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.rate_limiter = rate_limiter
+        # One worker per admitted request; Ollama schedules concurrent
+        # generations server-side, so calls need no client-side serialization.
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="ollama"
+        )
         self._active_count = 0
-        self._lock = asyncio.Lock()
-        self._llm_lock = asyncio.Lock()  # Serialize LLM access (not thread-safe)
+        # Slot workers with nothing queued, each parked on a future that
+        # submit() resolves with its next request (None: recheck the queue)
+        self._idle_slots: deque[asyncio.Future[InferenceRequest | None]] = deque()
+        self._slot_parked = asyncio.Event()
+        self._benchmark_lock = asyncio.Lock()  # Keep benchmark runs from overlapping
         self._running = False
         self._queue_worker_task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None  # Set once the worker starts
 
     @property
     def active_count(self) -> int:
@@ -55,49 +97,76 @@ class InferenceService:
     async def submit(self, request: InferenceRequest) -> bool:
         """Submit a request for processing.
 
-        If threads are available, processes immediately. Otherwise queues.
+        If a slot worker is idle and nothing is waiting, hands the request
+        straight to it. Otherwise queues it for the next free slot.
 
         Args:
             request: The inference request to process.
 
         Returns:
             True if processing immediately, False if queued.
+
+        Raises:
+            RuntimeError: If the tenant is over its rate limit or the queue
+                is full.
         """
-        async with self._lock:
-            if self._active_count < self.max_concurrent:
-                self._active_count += 1
-                # Process immediately in background
-                asyncio.create_task(self._process_with_tracking(request))
-                logger.info(
-                    f"Request {request.id} processing immediately "
-                    f"(active: {self._active_count}/{self.max_concurrent})"
+        if self.rate_limiter and not self.rate_limiter.try_acquire(request.tenant):
+            logger.warning("Request %s rejected: rate limit exceeded", request.id)
+            raise RuntimeError(
+                "Rate limit exceeded for this API key. Please retry shortly."
+            )
+
+        # Workers only park once the queue is empty, so queued requests keep
+        # their turn.
+        if self.request_queue.size == 0:
+            while self._idle_slots:
+                slot = self._idle_slots.popleft()
+                if slot.done():  # Worker was cancelled while parked
+                    continue
+                slot.set_result(request)
+                self._active_count += 1  # Busy from hand-off, not from wake-up
+                logger.debug(
+                    "Request %s processing immediately (active: %s/%s)",
+                    request.id,
+                    self._active_count,
+                    self.max_concurrent,
                 )
                 return True
-            else:
-                # Queue for later processing
-                try:
-                    await self.request_queue.put(request)
-                except asyncio.QueueFull as exc:
-                    logger.warning(
-                        "Request %s rejected: queue full (%s/%s)",
-                        request.id,
-                        self.request_queue.size,
-                        self.request_queue.maxsize,
-                    )
-                    raise RuntimeError(
-                        "Server busy: request queue is full. Please retry shortly."
-                    ) from exc
-
-                logger.info(
-                    f"Request {request.id} queued "
-                    f"(queue size: {self.request_queue.size}, "
-                    f"active: {self._active_count}/{self.max_concurrent})"
-                )
-                return False
+
+        try:
+            await self.request_queue.put(request)
+        except asyncio.QueueFull as exc:
+            if self.rate_limiter:
+                self.rate_limiter.refund(request.tenant)  # Not admitted, not charged
+            logger.warning(
+                "Request %s rejected: queue full (%s/%s)",
+                request.id,
+                self.request_queue.size,
+                self.request_queue.maxsize,
+            )
+            raise RuntimeError(
+                "Server busy: request queue is full. Please retry shortly."
+            ) from exc
+
+        logger.debug(
+            "Request %s queued (queue size: %s, active: %s/%s)",
+            request.id,
+            self.request_queue.size,
+            self._active_count,
+            self.max_concurrent,
+        )
+        return False
 
     async def _process_with_tracking(self, request: InferenceRequest) -> None:
-        """Process a request and track completion."""
+        """Process a request that was already counted as active."""
         try:
+            if request.cancelled:
+                # The client left (disconnect or sync timeout) while it was
+                # queued; don't spend a slot and a prefill on nobody.
+                logger.debug("Request %s cancelled before it started", request.id)
+                await request.fail(RuntimeError("Request cancelled before it started"))
+                return
+
             max_queue_wait_s = self.llm_manager.settings.max_queue_wait_s
             queued_for_s = time.monotonic() - request.created_at_monotonic
             if max_queue_wait_s > 0 and queued_for_s > max_queue_wait_s:
@@ -110,49 +179,89 @@ class InferenceService:
                 return
 
             await self._process_request(request)
+        except asyncio.CancelledError:
+            request.cancel()  # Stop the executor thread pulling from Ollama
+            await request.fail(RuntimeError("Inference service stopped"))
+            raise
         finally:
-            async with self._lock:
-                self._active_count -= 1
-            # Check if there are queued requests to process
-            await self._process_next_queued()
-
-    async def _process_next_queued(self) -> None:
-        """Check queue and process next request if capacity available."""
-        async with self._lock:
-            if self._active_count < self.max_concurrent and self.request_queue.size > 0:
+            self._active_count -= 1
+
+    async def _slot_worker(self) -> None:
+        """Process requests one at a time for a single concurrency slot.
+
+        Drains the queue while it has work, otherwise parks until submit()
+        hands over a request, so no task is created per request.
+        """
+        loop = asyncio.get_running_loop()
+        while self._running:
+            if self.request_queue.size:
+                request = await self.request_queue.get()
+                self._active_count += 1
+                logger.debug(
+                    "Request %s dequeued for processing (active: %s/%s)",
+                    request.id,
+                    self._active_count,
+                    self.max_concurrent,
+                )
+            else:
+                slot = loop.create_future()
+                self._idle_slots.append(slot)
+                self._slot_parked.set()
                 try:
-                    request = await asyncio.wait_for(
-                        self.request_queue.get(),
-                        timeout=0.1,
-                    )
+                    request = await slot
+                except asyncio.CancelledError:
+                    if slot.done() and not slot.cancelled() and slot.result():
+                        # Handed off (and counted) but never started
+                        self._active_count -= 1
+                        await slot.result().fail(
+                            RuntimeError("Inference service stopped")
+                        )
+                    raise
+                if request is None:  # Slot was borrowed and given back
+                    continue
+
+            try:
+                await self._process_with_tracking(request)
+            except Exception as e:
+                logger.error("Queue worker error: %s", e)
+
+    async def _claim_slot(self) -> asyncio.Future:
+        """Take a parked slot worker out of rotation, waiting for one if needed.
+
+        Workers drain the queue before parking, so this waits behind queued
+        requests. Pass the returned slot to ``_release_slot`` when done.
+        """
+        while True:
+            while self._idle_slots:
+                slot = self._idle_slots.popleft()
+                if not slot.done():
                     self._active_count += 1
-                    asyncio.create_task(self._process_with_tracking(request))
-                    self.request_queue.task_done()
-                    logger.info(
-                        f"Request {request.id} dequeued for processing "
-                        f"(active: {self._active_count}/{self.max_concurrent})"
-                    )
-                except asyncio.TimeoutError:
-                    pass
+                    return slot
+            self._slot_parked.clear()
+            await self._slot_parked.wait()
+
+    def _release_slot(self, slot: asyncio.Future) -> None:
+        """Give a claimed slot back; its worker rechecks the queue."""
+        self._active_count -= 1
+        if not slot.done():
+            slot.set_result(None)
 
     async def start_queue_worker(self) -> None:
-        """Start background worker to process queued requests."""
+        """Start one worker per concurrency slot and run until cancelled.
+
+        Each worker waits for its next request without polling and processes
+        it inline, so work starts as soon as a slot frees up.
+        """
         self._running = True
+        self._loop = asyncio.get_running_loop()
         logger.info("Inference service queue worker started")
 
-        while self._running:
-            try:
-                # Wait a bit then check for queued work
-                await asyncio.sleep(0.1)
-
-                if self.request_queue.size > 0:
-                    await self._process_next_queued()
-
-            except asyncio.CancelledError:
-                logger.info("Queue worker cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Queue worker error: {e}")
+        try:
+            async with asyncio.TaskGroup() as slots:
+                for _ in range(self.max_concurrent):
+                    slots.create_task(self._slot_worker())
+        except asyncio.CancelledError:
+            logger.info("Queue worker cancelled")
 
         logger.info("Inference service queue worker stopped")
 
@@ -166,31 +275,34 @@ class InferenceService:
         Args:
             request: The inference request to process.
         """
-        if not self.llm_manager or not self.llm_manager.is_loaded:
-            await request.fail(RuntimeError("Model not loaded"))
-            return
-
+        # Readiness is checked once in the route before submit(); should the
+        # model unload mid-flight, generate_stream raises and the request fails.
         try:
-            if request.stream:
-                await self._process_streaming(request)
-            else:
-                await self._process_sync(request)
-            logger.info(f"Request {request.id} completed")
+            await self._process_streaming(request)
+            logger.debug("Request %s completed", request.id)
         except Exception as e:
-            logger.error(f"Inference error for request {request.id}: {e}")
+            logger.error("Inference error for request %s: %s", request.id, e)
             await request.fail(e)
 
     async def _process_streaming(self, request: InferenceRequest) -> None:
-        """Process a streaming inference request.
+        """Process an inference request through Ollama's streaming API.
+
+        Non-streaming requests take the same path; their handler joins the
+        tokens, and generation can be cancelled mid-way like a stream.
 
         Args:
             request: The inference request to process.
         """
-        loop = asyncio.get_event_loop()
+        loop = self._loop or asyncio.get_running_loop()
+        flush_window_s = self.llm_manager.settings.sse_batch_window_ms / 1000
+        usage: dict = {}
 
         # Run inference in thread pool to avoid blocking
         def generate():
-            tokens = []
+            completion_tokens = 0
+            batch: list[str] = []
+            batch_size = _TOKEN_BATCH_MIN
+            last_flush = time.monotonic()
             for token in self.llm_manager.generate_stream(
                 prompt=request.prompt,
                 system=request.system,
@@ -199,22 +311,33 @@ class InferenceService:
                 top_p=request.top_p,
                 top_k=request.top_k,
                 stop=request.stop,
+                usage=usage,
             ):
-                tokens.append(token)
-                # Schedule token delivery on the event loop
-                asyncio.run_coroutine_threadsafe(
-                    request.put_token(token),
-                    loop,
-                )
-            return tokens
-
-        # Acquire LLM lock - llama-cpp is not thread-safe for concurrent inference
-        async with self._llm_lock:
-            tokens = await loop.run_in_executor(self._executor, generate)
-
-        # Calculate stats
-        prompt_tokens = self.llm_manager.get_token_count(request.prompt)
-        completion_tokens = len(tokens)
+                if request.cancelled:
+                    logger.info("Request %s cancelled by client", request.id)
+                    break
+                batch.append(token)
+                now = time.monotonic()
+                if len(batch) >= batch_size or now - last_flush >= flush_window_s:
+                    # Hand the batch to the event loop without a coroutine/Future
+                    loop.call_soon_threadsafe(request.put_tokens, batch)
+                    completion_tokens += len(batch)  # Counted per batch, not per token
+                    if len(batch) >= batch_size:
+                        batch_size = min(_TOKEN_BATCH_MAX, batch_size * _TOKEN_BATCH_GROWTH)
+                    batch = []
+                    last_flush = now
+            if batch:
+                loop.call_soon_threadsafe(request.put_tokens, batch)
+                completion_tokens += len(batch)
+            return completion_tokens
+
+        completion_tokens = await loop.run_in_executor(self._executor, generate)
+
+        # Prefer Ollama's own counts; estimate only if the stream ended early
+        prompt_tokens = usage.get("prompt_tokens") or self.llm_manager.get_token_count(
+            request.prompt
+        )
+        completion_tokens = usage.get("completion_tokens") or completion_tokens
 
         stats = {
             "prompt_tokens": prompt_tokens,
@@ -224,41 +347,6 @@ class InferenceService:
 
         await request.complete(stats)
 
-    async def _process_sync(self, request: InferenceRequest) -> None:
-        """Process a non-streaming inference request.
-
-        Args:
-            request: The inference request to process.
-        """
-        loop = asyncio.get_event_loop()
-
-        # Run inference in thread pool
-        def generate():
-            return self.llm_manager.generate(
-                prompt=request.prompt,
-                system=request.system,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-                top_k=request.top_k,
-                stop=request.stop,
-            )
-
-        # Acquire LLM lock - llama-cpp is not thread-safe for concurrent inference
-        async with self._llm_lock:
-            result = await loop.run_in_executor(self._executor, generate)
-
-        # Put the full text as a single token
-        await request.put_token(result["text"])
-
-        stats = {
-            "prompt_tokens": result["prompt_tokens"],
-            "completion_tokens": result["completion_tokens"],
-            "total_tokens": result["total_tokens"],
-        }
-
-        await request.complete(stats)
-
     def stop(self) -> None:
         """Stop the service."""
         self._running = False
@@ -279,7 +367,7 @@ class InferenceService:
         if not self.llm_manager or not self.llm_manager.is_loaded:
             raise RuntimeError("Model not loaded")
 
-        loop = asyncio.get_event_loop()
+        loop = self._loop or asyncio.get_running_loop()
         base_ctx = self.llm_manager.settings.n_ctx
         candidates = context_sizes or [max(512, min(base_ctx, 1024)), base_ctx]
 
@@ -295,61 +383,79 @@ class InferenceService:
         if not valid_contexts:
             valid_contexts = [base_ctx]
 
-        profiles = []
-        async with self._llm_lock:
-            for ctx in valid_contexts:
-                run_results = []
-                for _ in range(runs):
-                    result = await loop.run_in_executor(
+        profiles: list[_BenchmarkProfile] = []
+        best_profile: _BenchmarkProfile | None = None
+        async with self._benchmark_lock:
+            # Hold a concurrency slot so runs neither compete with nor get
+            # skewed by live /generate traffic
+            slot = await self._claim_slot()
+            run: asyncio.Future | None = None
+            try:
+                for ctx in valid_contexts:
+                    # All runs for a context go back-to-back in one executor task
+                    run = loop.run_in_executor(
                         self._executor,
-                        lambda target_ctx=ctx: self.llm_manager.generate_with_metrics(
-                            prompt=prompt,
-                            system=system,
-                            max_tokens=max_tokens,
-                            temperature=temperature,
-                            top_p=top_p,
-                            top_k=top_k,
-                            stop=[],
-                            n_ctx=target_ctx,
-                        ),
+                        lambda target_ctx=ctx: [
+                            self.llm_manager.generate_with_metrics(
+                                prompt=prompt,
+                                system=system,
+                                max_tokens=max_tokens,
+                                temperature=temperature,
+                                top_p=top_p,
+                                top_k=top_k,
+                                stop=[],
+                                n_ctx=target_ctx,
+                            )
+                            for _ in range(runs)
+                        ],
                     )
-                    run_results.append(result)
-
-                profile = {
-                    "context_size": ctx,
-                    "runs": runs,
-                    "avg_latency_ms": round(mean(r["latency_ms"] for r in run_results), 2),
-                    "avg_ttft_ms": round(
-                        mean(
-                            r["time_to_first_token_ms"]
-                            for r in run_results
-                            if r["time_to_first_token_ms"] is not None
-                        ),
-                        2,
+                    # Shielded: cancelling the benchmark can't stop the thread
+                    run_results = await asyncio.shield(run)
+
+                    latency_ms = ttft_ms = completion_tokens = tokens_per_s = 0.0
+                    ttft_runs = 0
+                    for r in run_results:
+                        latency_ms += r["latency_ms"]
+                        completion_tokens += r["completion_tokens"]
+                        tokens_per_s += r["completion_tokens_per_second"]
+                        if r["time_to_first_token_ms"] is not None:
+                            ttft_ms += r["time_to_first_token_ms"]
+                            ttft_runs += 1
+
+                    n = len(run_results)
+                    profile = _BenchmarkProfile(
+                        context_size=ctx,
+                        runs=runs,
+                        avg_latency_ms=round(latency_ms / n, 2),
+                        avg_ttft_ms=round(ttft_ms / ttft_runs, 2) if ttft_runs else None,
+                        avg_completion_tokens=round(completion_tokens / n, 2),
+                        avg_completion_tokens_per_second=round(tokens_per_s / n, 2),
                     )
-                    if any(r["time_to_first_token_ms"] is not None for r in run_results)
-                    else None,
-                    "avg_completion_tokens": round(
-                        mean(r["completion_tokens"] for r in run_results),
-                        2,
-                    ),
-                    "avg_completion_tokens_per_second": round(
-                        mean(r["completion_tokens_per_second"] for r in run_results),
-                        2,
-                    ),
-                }
-                profiles.append(profile)
-
-        best_profile = max(
-            profiles,
-            key=lambda p: (
-                p["avg_completion_tokens_per_second"],
-                -p["avg_latency_ms"],
-            ),
-        )
+                    profiles.append(profile)
+
+                    # Track the best profile as we go: highest throughput, then
+                    # lowest latency; the first one measured wins exact ties.
+                    if best_profile is None:
+                        best_profile = profile
+                    else:
+                        best_tps = best_profile.avg_completion_tokens_per_second
+                        tps = profile.avg_completion_tokens_per_second
+                        if tps > best_tps or (
+                            tps == best_tps
+                            and profile.avg_latency_ms < best_profile.avg_latency_ms
+                        ):
+                            best_profile = profile
+            finally:
+                if run is not None and not run.done():
+                    # Cancelled mid-run: the thread is still driving Ollama, so
+                    # keep the slot until it finishes
+                    run.add_done_callback(lambda _: self._release_slot(slot))
+                else:
+                    self._release_slot(slot)
+
         recommended_max_tokens = self._recommend_max_tokens(
             requested_max_tokens=max_tokens,
-            completion_tokens_per_second=best_profile["avg_completion_tokens_per_second"],
+            completion_tokens_per_second=best_profile.avg_completion_tokens_per_second,
         )
 
         return {
@@ -359,7 +465,7 @@ class InferenceService:
             "profiles": profiles,
             "recommended": {
                 "env": {
-                    "N_CTX": best_profile["context_size"],
+                    "N_CTX": best_profile.context_size,
                     "MAX_TOKENS": recommended_max_tokens,
                     "N_THREADS": self.llm_manager.settings.n_threads,
                     "OLLAMA_KEEP_ALIVE": self.llm_manager.settings.ollama_keep_alive,
@@ -380,14 +486,8 @@ class InferenceService:
         completion_tokens_per_second: float,
     ) -> int:
         """Pick a practical default max_tokens based on measured throughput."""
-        cap = max(32, requested_max_tokens)
-        if completion_tokens_per_second < 4:
-            return min(cap, 64)
-        if completion_tokens_per_second < 8:
-            return min(cap, 96)
-        if completion_tokens_per_second < 12:
-            return min(cap, 128)
-        return min(cap, 160)
+        tier = bisect.bisect_right(_RECOMMEND_TPS_THRESHOLDS, completion_tokens_per_second)
+        return min(max(32, requested_max_tokens), _RECOMMEND_MAX_TOKENS[tier])
 
 
 # Keep backward compatibility alias
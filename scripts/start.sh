@@ -71,12 +71,22 @@ fi
 HOST=${HOST:-0.0.0.0}
 PORT=${PORT:-8000}
 OLLAMA_PORT=${OLLAMA_PORT:-11434}
+# Parallel decode slots in the Ollama server; Ollama batches concurrent
+# requests across these slots, so match it to the service's concurrency.
+export OLLAMA_NUM_PARALLEL=${OLLAMA_NUM_PARALLEL:-${MAX_CONCURRENT_REQUESTS:-1}}
 
 echo "Starting Ollama server..."
 
 # Start Ollama in the background if not already running
 if ! curl -s "http://localhost:${OLLAMA_PORT}" > /dev/null 2>&1; then
-  ollama serve &
+  # Optionally pin the Ollama server (and the ggml threads it spawns) to a
+  # fixed set of cores, e.g. OLLAMA_CPUSET=0-3, so decode threads don't migrate.
+  if [ -n "${OLLAMA_CPUSET:-}" ] && command -v taskset &> /dev/null; then
+    echo "Pinning Ollama to CPUs ${OLLAMA_CPUSET}"
+    taskset -c "$OLLAMA_CPUSET" ollama serve &
+  else
+    ollama serve &
+  fi
   OLLAMA_PID=$!
   
   # Wait for Ollama to be ready
@@ -113,4 +123,10 @@ cleanup() {
 }
 trap cleanup EXIT
 
-exec uvicorn app.main:app --host "$HOST" --port "$PORT"
+UVICORN_LOOP=uvloop
+if ! python -c "import uvloop" > /dev/null 2>&1; then
+  echo "uvloop not installed; using the asyncio event loop"
+  UVICORN_LOOP=asyncio
+fi
+
+exec uvicorn app.main:app --host "$HOST" --port "$PORT" --loop "$UVICORN_LOOP" --http httptools
@@ -0,0 +1,25 @@
+"""Shared pytest fixtures."""
+
+import dataclasses
+import os
+import tempfile
+
+# Keep test runs away from the repo's real key store and key files; these
+# must be set before app modules read settings at import time.
+_TMP_DIR = tempfile.mkdtemp(prefix="pi-llm-tests-")
+os.environ.setdefault("API_KEYS_DB", os.path.join(_TMP_DIR, "api_keys.db"))
+os.environ.setdefault("API_KEYS_PATH", os.path.join(_TMP_DIR, "api_keys.txt"))
+
+import pytest  # noqa: E402
+
+from app.config import FrozenSettings, get_settings  # noqa: E402
+
+
+@pytest.fixture
+def make_settings():
+    """Build a settings snapshot with selected fields overridden."""
+
+    def _make(**overrides) -> FrozenSettings:
+        return dataclasses.replace(get_settings(), **overrides)
+
+    return _make
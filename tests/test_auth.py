@@ -0,0 +1,73 @@
+"""Tests for API key authentication helpers."""
+
+from typing import Annotated
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.core.auth import _APIKeyHeader, tenant_id, verify_api_key
+
+
+def test_tenant_id_is_stable_per_key():
+    assert tenant_id("key_one") == tenant_id("key_one")
+    assert tenant_id("key_one") != tenant_id("key_two")
+
+
+def test_tenant_id_does_not_expose_the_key():
+    key = "pi_" + "x" * 40
+    digest = tenant_id(key)
+
+    assert isinstance(digest, bytes)
+    assert len(digest) == 16
+    assert key.encode() not in digest
+
+
+def _header_client(scheme: _APIKeyHeader) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/whoami")
+    async def whoami(api_key: Annotated[str | None, Depends(scheme)]) -> dict:
+        return {"api_key": api_key}
+
+    return TestClient(app)
+
+
+def test_api_key_header_reads_configured_name():
+    client = _header_client(_APIKeyHeader(name="X-Custom-Key"))
+
+    response = client.get("/whoami", headers={"X-Custom-Key": "secret"})
+    assert response.json() == {"api_key": "secret"}
+    # The default header name is not accepted for a differently named scheme
+    response = client.get("/whoami", headers={"X-API-Key": "secret"})
+    assert response.status_code == 401
+
+
+def test_missing_api_key_uses_stock_challenge():
+    response = _header_client(_APIKeyHeader(name="X-API-Key")).get("/whoami")
+
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Not authenticated"}
+    assert response.headers["WWW-Authenticate"] == "APIKey"
+
+
+def test_missing_api_key_without_auto_error_returns_none():
+    client = _header_client(_APIKeyHeader(name="X-API-Key", auto_error=False))
+
+    assert client.get("/whoami").json() == {"api_key": None}
+
+
+def test_overlong_api_key_is_rejected():
+    client = _header_client(_APIKeyHeader(name="X-API-Key"))
+
+    response = client.get("/whoami", headers={"X-API-Key": "k" * 257})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid API key"}
+
+
+async def test_invalid_api_key_uses_stock_challenge():
+    with pytest.raises(HTTPException) as exc_info:
+        await verify_api_key("definitely-not-a-key")
+
+    assert exc_info.value.status_code == 401
+    assert exc_info.value.headers == {"WWW-Authenticate": "APIKey"}
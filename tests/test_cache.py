@@ -0,0 +1,54 @@
+"""Tests for the in-process TTL cache."""
+
+from app.core import cache as cache_module
+from app.core.cache import TTLCache
+
+
+def test_get_returns_default_when_missing():
+    cache = TTLCache(maxsize=2)
+    assert cache.get("missing") is None
+    assert cache.get("missing", 5) == 5
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+
+    now[0] = 109.0
+    assert cache.get("a") == 1
+    now[0] = 111.0
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_zero_maxsize_disables_caching():
+    cache = TTLCache(maxsize=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_discard_and_clear():
+    cache = TTLCache(maxsize=4)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.discard("a")
+    cache.discard("unknown")
+    assert cache.get("a") is None
+
+    cache.clear()
+    assert len(cache) == 0
@@ -0,0 +1,338 @@
+"""Tests for the inference service."""
+
+import asyncio
+import threading
+import time
+
+import orjson
+import pytest
+
+from app.api.schemas import BenchmarkResponse
+from app.core.queue import InferenceRequest, RequestQueue
+from app.core.ratelimit import RateLimiter
+from app.services.inference import InferenceService
+
+
+class FakeLLMManager:
+    """Stands in for LLMManager without an Ollama server."""
+
+    model_name = "test-model"
+    is_loaded = True
+
+    def __init__(self, settings, tokens=("Hello", " world")):
+        self.settings = settings
+        self.tokens = list(tokens)
+        self.calls: list[dict] = []
+
+    def generate_with_metrics(self, **kwargs) -> dict:
+        self.calls.append(kwargs)
+        tps = 10.0 if kwargs["n_ctx"] == 1024 else 5.0
+        return {
+            "text": "".join(self.tokens),
+            "prompt_tokens": 3,
+            "completion_tokens": 4,
+            "total_tokens": 7,
+            "latency_ms": 100.0,
+            "time_to_first_token_ms": 20.0,
+            "completion_tokens_per_second": tps,
+        }
+
+    def generate_stream(self, usage=None, **kwargs):
+        yield from self.tokens
+        if usage is not None:
+            usage["prompt_tokens"] = 3
+            usage["completion_tokens"] = len(self.tokens)
+
+    def get_token_count(self, text: str) -> int:
+        return len(text.split())
+
+
+async def _start_workers(svc: InferenceService) -> asyncio.Task:
+    worker = asyncio.create_task(svc.run())
+    while len(svc._idle_slots) < svc.max_concurrent:
+        await asyncio.sleep(0)
+    return worker
+
+
+@pytest.fixture
+async def service(make_settings):
+    svc = InferenceService(
+        FakeLLMManager(make_settings(n_ctx=2048, max_queue_wait_s=0)),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+    )
+    worker = await _start_workers(svc)
+    yield svc
+    worker.cancel()
+    await worker
+    svc.stop()
+
+
+async def test_benchmark_returns_benchmark_response_shape(service):
+    result = await service.benchmark(
+        prompt="Explain photosynthesis.", runs=2, context_sizes=[512, 1024, 1024, 100]
+    )
+
+    # The route serializes the dict as-is, so it must validate as the schema.
+    response = BenchmarkResponse.model_validate_json(orjson.dumps(result))
+    assert response.model == "test-model"
+    assert response.runs == 2
+    assert response.prompt_chars == len("Explain photosynthesis.")
+    assert [p.context_size for p in response.profiles] == [512, 1024]
+    assert len(service.llm_manager.calls) == 4
+
+    profile = response.profiles[1]
+    assert profile.runs == 2
+    assert profile.avg_latency_ms == 100.0
+    assert profile.avg_ttft_ms == 20.0
+    assert profile.avg_completion_tokens == 4.0
+    assert profile.avg_completion_tokens_per_second == 10.0
+
+    recommended = response.recommended
+    assert recommended.env.N_CTX == 1024
+    assert recommended.env.MAX_TOKENS == 128
+    assert recommended.request_defaults.stream is True
+
+
+async def test_benchmark_holds_a_slot_while_running(make_settings):
+    started = threading.Event()
+    release = threading.Event()
+
+    class BlockingLLMManager(FakeLLMManager):
+        def generate_with_metrics(self, **kwargs):
+            started.set()
+            release.wait(5)
+            return super().generate_with_metrics(**kwargs)
+
+    svc = InferenceService(
+        BlockingLLMManager(make_settings(max_queue_wait_s=0)),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+    )
+    worker = await _start_workers(svc)
+    try:
+        bench = asyncio.create_task(svc.benchmark(prompt="p", runs=1, context_sizes=[512]))
+        await asyncio.to_thread(started.wait, 5)
+        assert svc.active_count == 1
+
+        # Live traffic waits for the benchmark instead of overlapping it
+        request = InferenceRequest(prompt="q", stream=False)
+        assert await svc.submit(request) is False
+
+        release.set()
+        await bench
+        assert (await request.get_stats())["completion_tokens"] == 2
+        assert svc.active_count == 0
+    finally:
+        release.set()
+        worker.cancel()
+        await worker
+        svc.stop()
+
+
+async def test_cancelled_benchmark_keeps_its_slot_until_the_run_ends(make_settings):
+    started = threading.Event()
+    release = threading.Event()
+
+    class BlockingLLMManager(FakeLLMManager):
+        def generate_with_metrics(self, **kwargs):
+            started.set()
+            release.wait(5)
+            return super().generate_with_metrics(**kwargs)
+
+    svc = InferenceService(
+        BlockingLLMManager(make_settings(max_queue_wait_s=0)),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+    )
+    worker = await _start_workers(svc)
+    try:
+        bench = asyncio.create_task(svc.benchmark(prompt="p", runs=1, context_sizes=[512]))
+        await asyncio.to_thread(started.wait, 5)
+        bench.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await bench
+
+        # The executor thread is still running, so the slot stays taken
+        assert svc.active_count == 1
+        request = InferenceRequest(prompt="q", stream=False)
+        assert await svc.submit(request) is False
+
+        release.set()
+        assert (await asyncio.wait_for(request.get_stats(), 5))["completion_tokens"] == 2
+        assert svc.active_count == 0
+    finally:
+        release.set()
+        worker.cancel()
+        await worker
+        svc.stop()
+
+
+async def test_benchmark_falls_back_to_configured_context(service):
+    result = await service.benchmark(prompt="p", runs=1, context_sizes=[100, 9000])
+
+    response = BenchmarkResponse.model_validate_json(orjson.dumps(result))
+    assert [p.context_size for p in response.profiles] == [2048]
+
+
+@pytest.mark.parametrize(
+    ("tokens_per_second", "expected"),
+    [(0.0, 64), (3.9, 64), (4.0, 96), (8.0, 128), (12.0, 160), (50.0, 160)],
+)
+def test_recommend_max_tokens_tiers(tokens_per_second, expected):
+    assert InferenceService._recommend_max_tokens(160, tokens_per_second) == expected
+
+
+def test_recommend_max_tokens_respects_requested_cap():
+    assert InferenceService._recommend_max_tokens(100, 50.0) == 100
+    assert InferenceService._recommend_max_tokens(8, 50.0) == 32
+
+
+async def test_submit_does_not_charge_rate_limit_when_queue_full(make_settings):
+    limiter = RateLimiter(rate=0.0, burst=2)
+    svc = InferenceService(
+        FakeLLMManager(make_settings()),
+        RequestQueue(maxsize=1),
+        max_concurrent=1,
+        rate_limiter=limiter,
+    )
+    try:
+        # No worker running: the first request queues, the second finds it full
+        assert await svc.submit(InferenceRequest(prompt="a", tenant=b"t")) is False
+        with pytest.raises(RuntimeError, match="queue is full"):
+            await svc.submit(InferenceRequest(prompt="b", tenant=b"t"))
+
+        assert limiter.try_acquire(b"t")
+        assert not limiter.try_acquire(b"t")
+    finally:
+        svc.stop()
+
+
+async def test_submit_rejects_over_rate_limit(make_settings):
+    svc = InferenceService(
+        FakeLLMManager(make_settings()),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+        rate_limiter=RateLimiter(rate=0.0, burst=1),
+    )
+    try:
+        await svc.submit(InferenceRequest(prompt="a", tenant=b"t"))
+        with pytest.raises(RuntimeError, match="Rate limit"):
+            await svc.submit(InferenceRequest(prompt="b", tenant=b"t"))
+        assert svc.request_queue.size == 1
+    finally:
+        svc.stop()
+
+
+class SlowStreamLLMManager(FakeLLMManager):
+    """Streams tokens until the request is cancelled."""
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.streamed = 0
+        self.stopped = threading.Event()
+
+    def generate_stream(self, usage=None, **kwargs):
+        try:
+            for _ in range(500):
+                time.sleep(0.005)
+                self.streamed += 1
+                yield "x"
+        finally:
+            self.stopped.set()
+
+
+async def test_handed_off_request_counts_as_active_immediately(make_settings):
+    svc = InferenceService(
+        FakeLLMManager(make_settings(max_queue_wait_s=0)),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+    )
+    worker = await _start_workers(svc)
+    try:
+        request = InferenceRequest(prompt="p", stream=False)
+        assert await svc.submit(request) is True
+        assert svc.active_count == 1
+        assert not svc.has_capacity
+        # The slot is taken, so the next request queues instead of running
+        assert await svc.submit(InferenceRequest(prompt="q", stream=False)) is False
+
+        assert await request.get_stats() == {
+            "prompt_tokens": 3,
+            "completion_tokens": 2,
+            "total_tokens": 5,
+        }
+    finally:
+        worker.cancel()
+        await worker
+        svc.stop()
+
+
+async def test_stopping_service_cancels_in_flight_generation(make_settings):
+    llm = SlowStreamLLMManager(make_settings(max_queue_wait_s=0))
+    svc = InferenceService(llm, RequestQueue(maxsize=4), max_concurrent=1)
+    worker = await _start_workers(svc)
+    request = InferenceRequest(prompt="p")
+    await svc.submit(request)
+    while not llm.streamed:
+        await asyncio.sleep(0.005)
+
+    worker.cancel()
+    await worker
+
+    assert request.cancelled
+    assert svc.active_count == 0
+    with pytest.raises(RuntimeError, match="Inference service stopped"):
+        while await request.next_batch(1) is not None:
+            pass
+    assert await asyncio.to_thread(llm.stopped.wait, 2)
+    assert llm.streamed < 500
+    svc.stop()
+
+
+async def test_request_cancelled_while_queued_never_reaches_the_llm(make_settings):
+    class RecordingLLMManager(FakeLLMManager):
+        def generate_stream(self, usage=None, **kwargs):
+            self.calls.append(kwargs)
+            yield from super().generate_stream(usage=usage, **kwargs)
+
+    llm = RecordingLLMManager(make_settings(max_queue_wait_s=0))
+    svc = InferenceService(llm, RequestQueue(maxsize=4), max_concurrent=1)
+    # No worker is running yet, so the request waits in the queue
+    request = InferenceRequest(prompt="p")
+    assert await svc.submit(request) is False
+    request.cancel()
+
+    worker = await _start_workers(svc)
+    try:
+        with pytest.raises(RuntimeError, match="cancelled before it started"):
+            while await request.next_batch(1) is not None:
+                pass
+        assert llm.calls == []
+        assert svc.active_count == 0
+    finally:
+        worker.cancel()
+        await worker
+        svc.stop()
+
+
+async def test_streaming_falls_back_to_counted_tokens(make_settings):
+    class NoUsageLLMManager(FakeLLMManager):
+        def generate_stream(self, usage=None, **kwargs):
+            yield from ["a", "b", "c", "d", "e"]
+
+    svc = InferenceService(
+        NoUsageLLMManager(make_settings(max_queue_wait_s=0, sse_batch_window_ms=1000.0)),
+        RequestQueue(maxsize=4),
+        max_concurrent=1,
+    )
+    try:
+        request = InferenceRequest(prompt="one two three")
+        await svc._process_streaming(request)
+
+        assert [token async for token in request.token_stream()] == list("abcde")
+        stats = await request.get_stats()
+        assert stats["completion_tokens"] == 5
+        assert stats["total_tokens"] == stats["prompt_tokens"] + 5
+    finally:
+        svc.stop()
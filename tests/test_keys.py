@@ -0,0 +1,74 @@
+"""Tests for the SQLite key store and revocation bounds."""
+
+import sqlite3
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import auth
+from app.core import keys as keys_module
+from app.core.keys import REVOCATION_LAG_S, KeyStore, get_keystore
+
+
+@pytest.fixture
+def store(tmp_path):
+    keystore = KeyStore(tmp_path / "keys.db", pepper="test-pepper")
+    yield keystore
+    keystore.close()
+
+
+def test_add_verify_and_delete(store):
+    store.add_key("abc_secret", owner="t")
+
+    assert store.verify("abc_secret")
+    assert not store.verify("abc_other")
+    assert store.delete_key("abc_secret")
+    assert not store.verify("abc_secret")
+    assert not store.delete_key("abc_secret")
+
+
+def test_external_delete_expires_with_snapshot(store, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(keys_module.time, "monotonic", lambda: now[0])
+    store.add_key("abc_secret")
+    assert store.verify("abc_secret")
+
+    # Another process removes the key behind this store's back
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("DELETE FROM api_keys")
+
+    now[0] += keys_module._SNAPSHOT_TTL_S - 1
+    assert store.verify("abc_secret")
+    now[0] += 2
+    assert not store.verify("abc_secret")
+
+
+def test_stacked_caches_stay_within_revocation_bound():
+    assert keys_module._SNAPSHOT_TTL_S + auth._verified_keys.ttl <= REVOCATION_LAG_S
+
+
+async def test_in_process_delete_rejects_cached_key_immediately():
+    keystore = get_keystore(auth._DB_PATH)
+    keystore.add_key("tst_revoked-now")
+    assert await auth.verify_api_key("tst_revoked-now") == "tst_revoked-now"
+
+    assert keystore.delete_key("tst_revoked-now")
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.verify_api_key("tst_revoked-now")
+    assert exc_info.value.status_code == 401
+
+
+async def test_verify_api_key_reads_the_key_store_off_the_event_loop(monkeypatch):
+    keystore = get_keystore(auth._DB_PATH)
+    keystore.add_key("tst_off-loop")
+    threads = []
+    verify = keystore.verify
+
+    def recording_verify(raw_key):
+        threads.append(threading.current_thread())
+        return verify(raw_key)
+
+    monkeypatch.setattr(keystore, "verify", recording_verify)
+    assert await auth.verify_api_key("tst_off-loop") == "tst_off-loop"
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,23 @@
+"""Tests for the Ollama option builder."""
+
+from app.core.llm import LLMManager
+
+
+def test_build_options_gives_each_request_its_own_stop_list(make_settings):
+    llm = LLMManager(make_settings())
+
+    first = llm._build_options(None, 0.7, 0.9, 40, None)
+    first["stop"].append("\n")
+
+    assert llm._build_options(None, 0.7, 0.9, 40, None)["stop"] == []
+
+
+def test_build_options_copies_caller_stop_list(make_settings):
+    llm = LLMManager(make_settings())
+    stop = ["###"]
+
+    options = llm._build_options(64, 0.2, 0.9, 40, stop)
+    options["stop"].append("\n")
+
+    assert stop == ["###"]
+    assert options["num_predict"] == 64
@@ -0,0 +1,27 @@
+"""Tests for the application's schema and docs routes."""
+
+import orjson
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def test_openapi_schema_is_served_without_lifespan():
+    # No `with`: the lifespan (and its Ollama model load) never runs
+    client = TestClient(app)
+
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert orjson.loads(response.content) == app.openapi()
+    assert client.get("/openapi.json").content == response.content
+
+
+def test_docs_keep_the_oauth2_redirect_route():
+    client = TestClient(app)
+
+    docs = client.get("/docs")
+    assert docs.status_code == 200
+    assert "/docs/oauth2-redirect" in docs.text
+    assert client.get("/docs/oauth2-redirect").status_code == 200
+    assert client.get("/redoc").status_code == 200
@@ -0,0 +1,34 @@
+"""Tests for ASGI request guards."""
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.middleware import BodySizeLimitMiddleware
+
+
+def _client(max_body_bytes: int) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(body: dict) -> dict:
+        return body
+
+    app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=max_body_bytes)
+    return TestClient(app)
+
+
+def test_rejects_oversized_body():
+    response = _client(16).post("/echo", json={"prompt": "x" * 64})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large"}
+
+
+def test_allows_body_within_limit():
+    response = _client(64).post("/echo", json={"prompt": "hi"})
+    assert response.status_code == 200
+    assert response.json() == {"prompt": "hi"}
+
+
+def test_zero_limit_disables_check():
+    response = _client(0).post("/echo", json={"prompt": "x" * 1024})
+    assert response.status_code == 200
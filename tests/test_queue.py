@@ -0,0 +1,142 @@
+"""Tests for inference requests and the fair-share request queue."""
+
+import asyncio
+
+import pytest
+
+from app.core import queue as queue_module
+from app.core.queue import InferenceRequest, RequestQueue
+
+
+async def _drain(queue: RequestQueue) -> list[str]:
+    return [(await queue.get()).prompt for _ in range(queue.size)]
+
+
+async def test_round_robin_across_tenants():
+    queue = RequestQueue(maxsize=20)
+    for i in range(4):
+        await queue.put(InferenceRequest(prompt=f"a{i}", tenant=b"A"))
+    for i in range(2):
+        await queue.put(InferenceRequest(prompt=f"b{i}", tenant=b"B"))
+    await queue.put(InferenceRequest(prompt="c0", tenant=b"C"))
+
+    assert await _drain(queue) == ["a0", "b0", "c0", "a1", "b1", "a2", "a3"]
+    assert queue.size == 0
+
+
+async def test_priority_orders_requests_within_a_tenant():
+    queue = RequestQueue(maxsize=10)
+    await queue.put(InferenceRequest(prompt="low", priority=2))
+    await queue.put(InferenceRequest(prompt="high", priority=0))
+    await queue.put(InferenceRequest(prompt="normal"))
+
+    assert await _drain(queue) == ["high", "normal", "low"]
+
+
+async def test_long_prompt_yields_to_later_short_prompt():
+    queue = RequestQueue(maxsize=10)
+    await queue.put(InferenceRequest(prompt="x" * 5000))
+    await queue.put(InferenceRequest(prompt="short"))
+
+    assert await _drain(queue) == ["short", "x" * 5000]
+
+
+async def test_put_raises_when_full():
+    queue = RequestQueue(maxsize=1)
+    await queue.put(InferenceRequest(prompt="a"))
+
+    assert queue.is_full
+    with pytest.raises(asyncio.QueueFull):
+        await queue.put(InferenceRequest(prompt="b", tenant=b"other"))
+
+
+async def test_get_waits_for_put():
+    queue = RequestQueue()
+    getter = asyncio.create_task(queue.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+
+    await queue.put(InferenceRequest(prompt="late"))
+    assert (await asyncio.wait_for(getter, 1)).prompt == "late"
+
+
+async def test_token_stream_yields_until_complete():
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a", "b"])
+    await request.complete({})
+
+    assert [token async for token in request.token_stream()] == ["a", "b"]
+
+
+async def test_token_stream_raises_failure_after_pending_tokens():
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a"])
+    await request.fail(RuntimeError("boom"))
+
+    stream = request.token_stream()
+    assert await anext(stream) == "a"
+    with pytest.raises(RuntimeError, match="boom"):
+        await anext(stream)
+
+
+async def test_next_batch_returns_pending_then_none():
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a", "b"])
+    request.put_tokens(["c"])
+
+    assert await request.next_batch(1) == ["a", "b", "c"]
+    assert await request.next_batch(0.01) == []
+
+    await request.complete({"completion_tokens": 3})
+    assert await request.next_batch(1) is None
+    assert await request.get_stats() == {"completion_tokens": 3}
+
+
+async def test_next_batch_raises_failure_after_pending_tokens():
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a"])
+    await request.fail(RuntimeError("boom"))
+
+    assert await request.next_batch(1) == ["a"]
+    with pytest.raises(RuntimeError, match="boom"):
+        await request.next_batch(1)
+
+
+async def test_slow_consumer_backlog_cancels_generation(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(queue_module.time, "monotonic", lambda: now[0])
+    request = InferenceRequest(prompt="p", max_backlog=2, backlog_timeout_s=5.0)
+
+    request.put_tokens(["a", "b", "c"])  # over the backlog: timer starts
+    now[0] = 4.0
+    request.put_tokens(["d"])
+    assert not request.cancelled
+
+    now[0] = 6.0
+    request.put_tokens(["e"])
+    assert request.cancelled
+    await request.complete({})
+    assert await request.next_batch(1) == ["a", "b", "c", "d", "e"]
+    with pytest.raises(TimeoutError):
+        await request.next_batch(1)
+
+
+async def test_draining_backlog_resets_slow_consumer_timer(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(queue_module.time, "monotonic", lambda: now[0])
+    request = InferenceRequest(prompt="p", max_backlog=1, backlog_timeout_s=5.0)
+
+    request.put_tokens(["a", "b"])
+    await request.next_batch(1)
+    now[0] = 10.0
+    request.put_tokens(["c", "d"])
+    assert not request.cancelled
+
+
+async def test_next_batch_limit_leaves_remaining_tokens_buffered():
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a", "b", "c", "d", "e"])
+
+    assert await request.next_batch(1, limit=2) == ["a", "b"]
+    assert await request.next_batch(1, limit=2) == ["c", "d"]
+    assert await request.next_batch(1, limit=2) == ["e"]
@@ -0,0 +1,53 @@
+"""Tests for the per-key token bucket limiter."""
+
+from app.core import ratelimit as ratelimit_module
+from app.core.ratelimit import RateLimiter
+
+
+def test_allows_burst_then_rejects(monkeypatch):
+    monkeypatch.setattr(ratelimit_module.time, "monotonic", lambda: 0.0)
+    limiter = RateLimiter(rate=1.0, burst=2)
+
+    assert limiter.try_acquire("a")
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+    # Buckets are independent per key
+    assert limiter.try_acquire("b")
+
+
+def test_refills_over_time(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(ratelimit_module.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(rate=2.0, burst=1)
+
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+    now[0] = 0.5
+    assert limiter.try_acquire("a")
+
+
+def test_tracks_at_most_maxsize_keys(monkeypatch):
+    monkeypatch.setattr(ratelimit_module.time, "monotonic", lambda: 0.0)
+    limiter = RateLimiter(rate=0.0, burst=1, maxsize=2)
+
+    assert limiter.try_acquire("a")
+    assert limiter.try_acquire("b")
+    assert limiter.try_acquire("c")  # evicts "a"
+    assert len(limiter._buckets) == 2
+    # An evicted key starts over with a full bucket
+    assert limiter.try_acquire("a")
+
+
+def test_refund_returns_tokens_up_to_burst(monkeypatch):
+    monkeypatch.setattr(ratelimit_module.time, "monotonic", lambda: 0.0)
+    limiter = RateLimiter(rate=0.0, burst=1)
+
+    assert limiter.try_acquire("a")
+    limiter.refund("a")
+    assert limiter.try_acquire("a")
+
+    limiter.refund("a")
+    limiter.refund("a")  # Never above the bucket size
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+    limiter.refund("unknown")  # No bucket, nothing to refund
@@ -0,0 +1,104 @@
+"""Tests for API route helpers."""
+
+import asyncio
+
+import orjson
+
+from app.api.routes import (
+    _DONE_FRAME,
+    _ERROR_FRAME,
+    _TOKENS_FRAME,
+    build_max_tokens_policy,
+    stream_generator,
+)
+from app.core.queue import InferenceRequest
+
+
+def test_max_tokens_policy_applies_default_and_caps(make_settings):
+    policy = build_max_tokens_policy(
+        make_settings(max_tokens=96, max_request_tokens_cap=128, busy_max_tokens=64)
+    )
+
+    assert policy(None, 0) == 96
+    assert policy(100, 0) == 100
+    assert policy(500, 0) == 128
+
+
+def test_max_tokens_policy_caps_when_queue_busy(make_settings):
+    policy = build_max_tokens_policy(
+        make_settings(max_tokens=96, max_request_tokens_cap=128, busy_max_tokens=64)
+    )
+
+    assert policy(None, 1) == 64
+    assert policy(32, 3) == 32
+
+
+def test_max_tokens_policy_never_returns_below_one(make_settings):
+    policy = build_max_tokens_policy(
+        make_settings(max_tokens=0, max_request_tokens_cap=0, busy_max_tokens=0)
+    )
+
+    assert policy(None, 0) == 1
+    assert policy(None, 5) == 1
+
+
+async def _frames(inference_request, settings) -> list[bytes]:
+    return [frame async for frame in stream_generator(inference_request, settings)]
+
+
+def _sse_settings(make_settings, **overrides):
+    return make_settings(
+        **{
+            "sse_batch_tokens": 4,
+            "sse_batch_window_ms": 50.0,
+            "sse_ping_interval_s": 1.0,
+            **overrides,
+        }
+    )
+
+
+async def test_stream_generator_caps_tokens_per_frame(make_settings):
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a", "b", "c", "d", "e", "f"])
+    await request.complete({"prompt_tokens": 1, "completion_tokens": 6, "total_tokens": 7})
+
+    frames = await _frames(request, _sse_settings(make_settings))
+
+    assert frames == [
+        _TOKENS_FRAME % orjson.dumps(["a", "b", "c", "d"]),
+        _TOKENS_FRAME % orjson.dumps(["e", "f"]),
+        _DONE_FRAME % (1, 6, 7),
+    ]
+
+
+async def test_stream_generator_flushes_pending_tokens_before_error(make_settings):
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a"])
+    request.put_tokens(["b"])
+    await request.fail(RuntimeError("boom"))
+
+    frames = await _frames(request, _sse_settings(make_settings))
+
+    assert frames == [
+        _TOKENS_FRAME % orjson.dumps(["a", "b"]),
+        _ERROR_FRAME % orjson.dumps({"error": "boom"}),
+    ]
+
+
+async def test_stream_generator_flushes_batch_when_failing_mid_coalesce(make_settings):
+    request = InferenceRequest(prompt="p")
+    request.put_tokens(["a"])
+
+    async def fail_soon():
+        await asyncio.sleep(0.01)
+        request.put_tokens(["b"])
+        await request.fail(RuntimeError("boom"))
+
+    failer = asyncio.create_task(fail_soon())
+    frames = await _frames(request, _sse_settings(make_settings, sse_batch_window_ms=500.0))
+    await failer
+
+    assert frames == [
+        _TOKENS_FRAME % orjson.dumps(["a", "b"]),
+        _ERROR_FRAME % orjson.dumps({"error": "boom"}),
+    ]